@@ -0,0 +1,126 @@
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from horadrimSoftware import (BPlusTree, BTREE_FANOUT, COMPRESSION_CODECS, PAGESIZE, CompressedDataFile, DataFile,
+                              TypeSchema, compressedImage, packAddress, segmentImage)
+
+LOOKUPS = 100000
+
+
+def benchmarkBTree(nofKeys, fanout):
+    """Insert nofKeys random keys and time point lookups.
+    Returns:
+        (int, float, float): depth of the tree, insert time per key and lookup time per key in microseconds
+    """
+    keys = random.sample(range(nofKeys * 10), nofKeys)
+    bplustree = BPlusTree(fanout)
+
+    start = time.perf_counter()
+    for key in keys:
+        bplustree[key] = key
+    insertTime = (time.perf_counter() - start) / nofKeys
+
+    probes = random.choices(keys, k=LOOKUPS)
+    start = time.perf_counter()
+    for key in probes:
+        bplustree.query(key)
+    lookupTime = (time.perf_counter() - start) / LOOKUPS
+
+    return bplustree.depth, insertTime * 1e6, lookupTime * 1e6
+
+
+def benchmarkMemory(nofKeys, fanout):
+    """Bulk loads nofKeys int keys with record addresses, once kept as lists of "file,byte"
+    strings and once in typed arrays with packed addresses.
+    Returns:
+        (float, float): bytes per key of the list tree and of the compact tree
+    """
+    result = []
+    for compact in (False, True):
+        tracemalloc.start()
+        if compact:
+            bplustree = BPlusTree(fanout, "q", "Q")
+            items = [(i, packAddress(i // 1000 + 1, i // 100 % 10, i % 100)) for i in range(nofKeys)]
+        else:
+            bplustree = BPlusTree(fanout)
+            items = [(i, "Angel_" + str(i // 1000 + 1) + ".txt," + str(i * 21 % 20000)) for i in range(nofKeys)]
+        bplustree.bulkLoad(items)
+        del items
+        result.append(tracemalloc.get_traced_memory()[0] / nofKeys)
+        tracemalloc.stop()
+        del bplustree
+    return result[0], result[1]
+
+
+def benchmarkCompression(nofPages, codecName, recordFormat):
+    """Writes a full data file of nofPages pages of id int, name str, hp int records, compresses
+    it and times random page reads from both files, the way the buffer pool reads a page.
+    Returns:
+        (float, float, float): compressed size over plain size, and the plain and compressed
+        read time per page in microseconds
+    """
+    schema = TypeSchema("Bench", 3, 1, ["id", "int", "name", "str", "hp", "int"], [], {"format": recordFormat})
+    image = bytearray(segmentImage(schema.lengthOfARecord, nofPages))
+    for pageNo in range(nofPages):
+        image[pageNo*PAGESIZE] = ord("1")
+        for slot in range(schema.recordsInAPage):
+            start = pageNo*PAGESIZE + schema.recordOffset(slot)
+            key = pageNo*schema.recordsInAPage + slot
+            image[start] = ord("1")
+            schema.recordFormat.pack_into(image, start+1, [str(key), "n" + str(random.randrange(1000)),
+                                                           str(random.randrange(500))])
+
+    directory = tempfile.mkdtemp()
+    plainName = os.path.join(directory, "Bench_1.txt")
+    compressedName = os.path.join(directory, "Bench_2.txt")
+    with open(plainName, "wb") as file:
+        file.write(image)
+    plain = DataFile(plainName)
+    with open(compressedName, "wb") as file:
+        file.write(compressedImage(plain, codecName))
+    compressed = CompressedDataFile(compressedName)
+    ratio = os.path.getsize(compressedName) / os.path.getsize(plainName)
+
+    probes = random.choices(range(nofPages), k=LOOKUPS // 10)
+    times = []
+    for dataFile in (plain, compressed):
+        start = time.perf_counter()
+        for pageNo in probes:
+            bytearray(dataFile.readPage(pageNo))
+        times.append((time.perf_counter() - start) / len(probes))
+        dataFile.close()
+    os.remove(plainName)
+    os.remove(compressedName)
+    os.rmdir(directory)
+
+    return ratio, times[0] * 1e6, times[1] * 1e6
+
+
+if __name__ == '__main__':
+    # python3 src/horadrimBenchmark.py [fanout] [sizes...]
+    fanout = int(sys.argv[1]) if len(sys.argv) > 1 else BTREE_FANOUT
+    sizes = [int(x) for x in sys.argv[2:]] or [10000, 100000, 1000000]
+
+    print("fanout", fanout)
+    print("{:>10} {:>6} {:>12} {:>12}".format("keys", "depth", "insert(us)", "lookup(us)"))
+    for size in sizes:
+        depth, insertTime, lookupTime = benchmarkBTree(size, fanout)
+        print("{:>10} {:>6} {:>12.2f} {:>12.2f}".format(size, depth, insertTime, lookupTime))
+
+    print()
+    print("{:>10} {:>14} {:>14}".format("keys", "lists(B/key)", "arrays(B/key)"))
+    for size in sizes:
+        listBytes, arrayBytes = benchmarkMemory(size, fanout)
+        print("{:>10} {:>14.1f} {:>14.1f}".format(size, listBytes, arrayBytes))
+
+    print()
+    print("{:>6} {:>8} {:>8} {:>10} {:>15}".format("codec", "format", "ratio", "plain(us)", "compressed(us)"))
+    for codecName in COMPRESSION_CODECS:
+        for recordFormat in ("text", "binary"):
+            ratio, plainTime, compressedTime = benchmarkCompression(1000, codecName, recordFormat)
+            print("{:>6} {:>8} {:>8.3f} {:>10.2f} {:>15.2f}".format(codecName, recordFormat, ratio, plainTime,
+                                                                   compressedTime))
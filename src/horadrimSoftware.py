@@ -3,20 +3,97 @@ import random
 import sys
 import time
 import json
-import re
 import os
 import math
 import ast
+import bisect
+import collections
+import mmap
+import csv
+import heapq
+import struct
+import array
+import itertools
+import zlib
+import lzma
+
+try:
+    import numpy
+except ImportError:
+    # filters on fields without an index then decode the records one by one
+    numpy = None
 
 PAGESIZE = 2000
+# pages of a data file (segment), unless the type sets pages=N. Addresses keep 16 bits for the page number
 PAGE_IN_A_FILE = 10
+MAX_PAGES_IN_A_FILE = 1 << 16
+
+FIELD_LENGTH = 20
+ADDRESS_LENGTH = 12
+# an index node holds as many (key, address) entries as fit in a page
+BTREE_FANOUT = PAGESIZE // (FIELD_LENGTH + ADDRESS_LENGTH)
+# below this a node may be left with no keys after a delete
+MIN_BTREE_FANOUT = 4
+BUFFER_POOL_PAGES = 256
+# keys the in-memory indexes may hold before the least recently used ones are unloaded, 0 for no limit
+INDEX_BUDGET = 0
+# planner statistics: histogram buckets, and the share of a type that may change before they are gathered again
+HISTOGRAM_BUCKETS = 32
+STATISTICS_REFRESH = 0.1
+# records list and filter read per batch, pinning each data page of a batch once
+SCAN_BATCH = 256
+# results of repeated queries kept between writes to their type: entries, and characters of output
+RESULT_CACHE_ENTRIES = 256
+RESULT_CACHE_SIZE = 1 << 20
+# record changes are logged to WAL_FILE and synced once per WAL_GROUP_SIZE changes or WAL_GROUP_WINDOW seconds
+WAL_FILE = "writeAheadLog.txt"
+WAL_GROUP_SIZE = 64
+WAL_GROUP_WINDOW = 0.05
+# how an empty (null) field is written in the log, where every field has to be one word
+WAL_NULL = "\\N"
+# functions of the aggregate commands, e.g. sum record Angel hp
+AGGREGATES = ("count", "min", "max", "sum", "avg")
+# how full load record packs the B+ tree nodes, leaving room for later inserts
+BULK_FILL_FACTOR = 0.9
+
+# index=paged types keep their B+ tree in an index file
+INDEX_CACHE_PAGES = 64
+INDEX_MAGIC = b"HBPI"
+INDEX_VERSION = 2
+INDEX_META = struct.Struct("<4sHiiiIB")
+INDEX_PAGE_HEADER = struct.Struct("<BHii")
+
+SNAPSHOT_MAGIC = b"HBPT"
+SNAPSHOT_VERSION = 2
+SNAPSHOT_HEADER = struct.Struct("<4sHBI")
+
+# data files of compress=<codec> types that were not written for COLD_SEGMENT_AGE seconds are
+# compressed page by page at a checkpoint, the newest file of a type is left as it is
+COMPRESSION_CODECS = {"zlib": zlib, "lzma": lzma}
+COMPRESSED_MAGIC = b"HZDF"
+COMPRESSED_HEADER = struct.Struct("<4s4sI")
+COLD_SEGMENT_AGE = 60
 
 splits = 0
 parent_splits = 0
 fusions = 0
 parent_fusions = 0
 
-bTrees = {}
+# IndexCache, FreeSpaceMaps, ResultCache and WriteAheadLog, created in main
+bTrees = None
+freeSpaceMaps = None
+resultCache = None
+writeAheadLog = None
+catalog = None
+bufferPool = None
+# types whose index or free-space map changed since they were loaded
+modifiedTypes = set()
+# number of changes to each type during this run, a cached result of an older version is stale
+typeVersions = collections.Counter()
+# planner statistics by type name, see TypeStatistics
+typeStatistics = {}
+# empty data file images by (record length, pages), see segmentImage
+segmentImages = {}
 
 
 
@@ -26,6 +103,7 @@ class Node(object):
     Attributes:
         parent
     """
+    __slots__ = ("keys", "values", "parent")
 
     def __init__(self, parent=None):
         """Child nodes are stored in values. Parent nodes simply act as a medium to traverse the tree.
@@ -36,23 +114,16 @@ class Node(object):
 
     def getAddress(self, x):
 
-        index = 0
+        index = bisect.bisect_left(self.keys, x)
 
-        for i in self.keys:
-            if i == x:
-                adr = self.values[index]
-                return adr
-            index = index+1
+        if index < len(self.keys) and self.keys[index] == x:
+            return self.values[index]
 
     def index(self, key):
         """Return the index where the key should be.
         :type key: str
         """
-        for i, item in enumerate(self.keys):
-            if key < item:
-                return i
-
-        return len(self.keys)
+        return bisect.bisect_right(self.keys, key)
 
     def __getitem__(self, item):
         return self.values[self.index(item)]
@@ -142,6 +213,10 @@ class Node(object):
 
 
 class Leaf(Node):
+    """Leaves hold the records' keys and addresses. A tree created with typecodes keeps them in
+    typed arrays rather than lists."""
+    __slots__ = ("next", "prev")
+
     def __init__(self, parent=None, prev_node=None, next_node=None):
         """
         Create a new leaf in the leaf link
@@ -156,16 +231,26 @@ class Leaf(Node):
         if prev_node is not None:
             prev_node.next = self
 
+    def position(self, key):
+        """Return the index of the key in this leaf, or -1 if it is not here."""
+        i = bisect.bisect_left(self.keys, key)
+        if i < len(self.keys) and self.keys[i] == key:
+            return i
+        return -1
+
     def __getitem__(self, item):
-        return self.values[self.keys.index(item)]
+        i = self.position(item)
+        if i < 0:
+            raise KeyError(item)
+        return self.values[i]
 
     def __setitem__(self, key, value):
-        i = self.index(key)
-        if key not in self.keys:
-            self.keys[i:i] = [key]
-            self.values[i:i] = [value]
+        i = bisect.bisect_left(self.keys, key)
+        if i < len(self.keys) and self.keys[i] == key:
+            self.values[i] = value
         else:
-            self.values[i - 1] = value
+            self.keys.insert(i, key)
+            self.values.insert(i, value)
 
     def split(self):
         global splits
@@ -177,14 +262,16 @@ class Leaf(Node):
         left.keys = self.keys[:mid]
         left.values = self.values[:mid]
 
-        self.keys: list = self.keys[mid:]
-        self.values: list = self.values[mid:]
+        self.keys = self.keys[mid:]
+        self.values = self.values[mid:]
 
         # When the leaf node is split, set the parent key to the left-most key of the right child node.
         return self.keys[0], [left, self]
 
     def __delitem__(self, key):
-        i = self.keys.index(key)
+        i = self.position(key)
+        if i < 0:
+            raise KeyError(key)
         del self.keys[i]
         del self.values[i]
 
@@ -207,13 +294,13 @@ class Leaf(Node):
     def borrow_key(self, minimum: int):
         index = self.parent.index(self.keys[0])
         if index < len(self.parent.keys) and len(self.next.keys) > minimum:
-            self.keys += [self.next.keys.pop(0)]
-            self.values += [self.next.values.pop(0)]
+            self.keys.append(self.next.keys.pop(0))
+            self.values.append(self.next.values.pop(0))
             self.parent.keys[index] = self.next.keys[0]
             return True
         elif index != 0 and len(self.prev.keys) > minimum:
-            self.keys[0:0] = [self.prev.keys.pop()]
-            self.values[0:0] = [self.prev.values.pop()]
+            self.keys.insert(0, self.prev.keys.pop())
+            self.values.insert(0, self.prev.values.pop())
             self.parent.keys[index - 1] = self.keys[0]
             return True
 
@@ -225,15 +312,28 @@ class BPlusTree(object):
     Nodes will automatically be split into two once it is full. When a split occurs, a key will
     'float' upwards and be inserted into the parent node to act as a pivot.
     Attributes:
-        maximum (int): The maximum number of keys each node can hold.
+        maximum (int): The maximum number of keys each node can hold. Defaults to as many
+            entries as fit in one PAGESIZE page.
+        keyCode, valueCode (str): array typecodes for the keys and values of the leaves,
+            None keeps them in lists
+        size (int): number of keys in the tree
     """
     root: Node
 
-    def __init__(self, maximum=4):
-        self.root = Leaf()
+    def __init__(self, maximum=BTREE_FANOUT, keyCode=None, valueCode=None):
+        self.keyCode = keyCode
+        self.valueCode = valueCode
+        self.root = self.newLeaf()
         self.maximum: int = maximum if maximum > 2 else 2
         self.minimum: int = self.maximum // 2
         self.depth = 0
+        self.size = 0
+
+    def newLeaf(self, prev_node=None, keys=(), values=()) -> Leaf:
+        leaf = Leaf(None, prev_node)
+        leaf.keys = list(keys) if self.keyCode is None else array.array(self.keyCode, keys)
+        leaf.values = list(values) if self.valueCode is None else array.array(self.valueCode, values)
+        return leaf
 
     def find(self, key) -> Leaf:
         """ find the leaf
@@ -250,10 +350,12 @@ class BPlusTree(object):
     def __getitem__(self, item):
         return self.find(item)[item]
 
+    def __contains__(self, key):
+        return self.find(key).position(key) >= 0
+
     def query(self, key):
         """Returns a value for a given key, and None if the key does not exist."""
-        leaf = self.find(key)
-        return leaf[key] if key in leaf.keys else None
+        return self.find(key).getAddress(key)
 
     def change(self, key, value):
         """change the value
@@ -261,7 +363,7 @@ class BPlusTree(object):
             (bool,Leaf): the leaf where the key is. return False if the key does not exist
         """
         leaf = self.find(key)
-        if key not in leaf.keys:
+        if leaf.position(key) < 0:
             return False, leaf
         else:
             leaf[key] = value
@@ -273,17 +375,20 @@ class BPlusTree(object):
               """
         if leaf is None:
             leaf = self.find(key)
+        n = len(leaf.keys)
         leaf[key] = value
+        self.size += len(leaf.keys) - n
         if len(leaf.keys) > self.maximum:
             self.insert_index(*leaf.split())
 
-    def insert(self, key, value):
+    def insert(self, key, value, leaf=None):
         """
         Returns:
             (bool,Leaf): the leaf where the key is inserted. return False if already has same key
         """
-        leaf = self.find(key)
-        if key in leaf.keys:
+        if leaf is None:
+            leaf = self.find(key)
+        if leaf.position(key) >= 0:
             return False, leaf
         else:
             self.__setitem__(key, value, leaf)
@@ -311,6 +416,8 @@ class BPlusTree(object):
         if node is None:
             node = self.find(key)
         del node[key]
+        if type(node) is Leaf:
+            self.size -= 1
 
         if len(node.keys) < self.minimum:
             if node == self.root:
@@ -340,7 +447,7 @@ class BPlusTree(object):
         """Prints the keys at each level."""
         if node is None:
             node = self.root
-        print(_prefix, "`- " if _last else "|- ", node.keys, sep="", file=file)
+        print(_prefix, "`- " if _last else "|- ", list(node.keys), sep="", file=file)
         _prefix += "   " if _last else "|  "
 
         if type(node) is Node:
@@ -367,6 +474,1533 @@ class BPlusTree(object):
             node = node.values[0]
         return node
 
+    def scan(self, low=None, high=None, includeLow=True, includeHigh=True):
+        """Yields (key, value) pairs between low and high in key order. Descends once to the
+        lower bound and then follows the leaf chain. A bound of None leaves that side open.
+        """
+        if low is None:
+            leaf = self.leftmost_leaf()
+            i = 0
+        else:
+            leaf = self.find(low)
+            if includeLow:
+                i = bisect.bisect_left(leaf.keys, low)
+            else:
+                i = bisect.bisect_right(leaf.keys, low)
+
+        while leaf is not None:
+            keys = leaf.keys
+            while i < len(keys):
+                key = keys[i]
+                if high is not None and (high < key or (key == high and not includeHigh)):
+                    return
+                yield key, leaf.values[i]
+                i = i + 1
+            leaf = leaf.next
+            i = 0
+
+    def last(self, high=None, includeHigh=True):
+        """Returns the (key, value) pair with the largest key up to high, None if there is none.
+        Descends once and steps back along the leaf chain if the leaf has no smaller key."""
+        if high is None:
+            leaf = self.root
+            while type(leaf) is not Leaf:
+                leaf = leaf.values[-1]
+            i = len(leaf.keys)
+        else:
+            leaf = self.find(high)
+            i = bisect.bisect_right(leaf.keys, high) if includeHigh else bisect.bisect_left(leaf.keys, high)
+
+        while i == 0:
+            leaf = leaf.prev
+            if leaf is None:
+                return None
+            i = len(leaf.keys)
+        return leaf.keys[i-1], leaf.values[i-1]
+
+    def empty(self):
+        return len(self.root.keys) == 0
+
+    def bulkLoad(self, items, fillFactor=1.0):
+        """Replaces the contents of the tree with (key, value) pairs that are sorted by key.
+        The leaves are filled left to right and each index level is built on top of the one
+        below, so no node is ever split.
+        """
+        size = min(self.maximum, max(self.minimum, int(self.maximum * fillFactor)))
+        self.root = self.newLeaf()
+        self.depth = 0
+        self.size = len(items)
+
+        if len(items) == 0:
+            return
+
+        nodes = []
+        lows = []
+        prev = None
+        start = 0
+        for count in partition(len(items), size, self.minimum):
+            leaf = self.newLeaf(prev, [key for key, value in items[start:start+count]],
+                                [value for key, value in items[start:start+count]])
+            nodes.append(leaf)
+            lows.append(leaf.keys[0])
+            prev = leaf
+            start += count
+
+        while len(nodes) > 1:
+            parents = []
+            parentLows = []
+            start = 0
+            for count in partition(len(nodes), size + 1, self.minimum + 1):
+                node = Node()
+                node.values = nodes[start:start+count]
+                node.keys = lows[start+1:start+count]
+                for child in node.values:
+                    child.parent = node
+                parents.append(node)
+                parentLows.append(lows[start])
+                start += count
+            nodes = parents
+            lows = parentLows
+            self.depth += 1
+
+        self.root = nodes[0]
+
+    def keys(self):
+        """Yields the keys in order by following the leaf chain."""
+        leaf = self.leftmost_leaf()
+        while leaf is not None:
+            yield from leaf.keys
+            leaf = leaf.next
+
+
+def partition(n, size, minimum):
+    """Splits n entries into groups of about size entries, none of them under minimum.
+    Returns:
+        list: the size of each group
+    """
+    groups = max(1, min(-(-n // size), n // minimum))
+    return [n // groups + (1 if i < n % groups else 0) for i in range(groups)]
+
+
+class IndexPage(object):
+    """A node of a PagedBPlusTree, decoded from one page of the index file.
+    Attributes:
+        values: record addresses in a leaf, child page numbers in an index node
+        path (list): page numbers from the root down to this node, set by find
+    """
+    __slots__ = ("pageNo", "isLeaf", "keys", "values", "next", "prev", "dirty", "path")
+
+    def __init__(self, pageNo, isLeaf, keys=None, values=None, next_page=-1, prev_page=-1):
+        self.pageNo: int = pageNo
+        self.isLeaf: bool = isLeaf
+        self.keys: list = keys if keys is not None else []
+        self.values: list = values if values is not None else []
+        self.next: int = next_page
+        self.prev: int = prev_page
+        self.dirty: bool = True
+        self.path: list = []
+
+    def position(self, key):
+        i = bisect.bisect_left(self.keys, key)
+        if i < len(self.keys) and self.keys[i] == key:
+            return i
+        return -1
+
+    def getAddress(self, key):
+        i = self.position(key)
+        if i >= 0:
+            return self.values[i]
+
+
+class PagedBPlusTree(object):
+    """B+ tree stored in PAGESIZE pages of an index file, for types whose index should not
+    be kept in memory. Page 0 holds the root page number and the free page list, every
+    other page is one node. A search reads the pages on its way from disk, and at most
+    INDEX_CACHE_PAGES decoded nodes stay in memory. Only the pages an operation changed are
+    written back. A node that becomes empty is unlinked from its parent rather than fused
+    with a sibling.
+    """
+
+    def __init__(self, fileName, type_name, key_type, cacheSize=INDEX_CACHE_PAGES):
+        self.fileName: str = fileName
+        self.type_name: str = type_name
+        self.isStr: bool = key_type != "int"
+        self.keySize: int = FIELD_LENGTH if self.isStr else 8
+        self.leafCapacity: int = (PAGESIZE - INDEX_PAGE_HEADER.size) // (self.keySize + 8)
+        self.nodeCapacity: int = (PAGESIZE - INDEX_PAGE_HEADER.size - 4) // (self.keySize + 4)
+        self.cacheSize: int = max(cacheSize, 16)
+        self.cache = collections.OrderedDict()
+
+        if not os.path.exists(fileName):
+            f = open(fileName, "wb")
+            f.write(bytes(2*PAGESIZE))
+            f.close()
+            self.file = DataFile(fileName)
+            self.root: int = 1
+            self.depth: int = 0
+            self.freeHead: int = -1
+            self.nofPages: int = 2
+            self.cache[1] = IndexPage(1, True)
+            self.writeMeta()
+        else:
+            self.file = DataFile(fileName)
+            magic, version, self.root, self.depth, self.freeHead, self.nofPages, isStr = \
+                INDEX_META.unpack_from(self.file.readPage(0))
+            if magic != INDEX_MAGIC or version != INDEX_VERSION:
+                raise ValueError("unknown index file format in " + fileName)
+
+    def writeMeta(self):
+        logBeforeWrite()
+        meta = bytearray(PAGESIZE)
+        INDEX_META.pack_into(meta, 0, INDEX_MAGIC, INDEX_VERSION, self.root, self.depth,
+                             self.freeHead, self.nofPages, self.isStr)
+        self.file.writePage(0, meta)
+
+    def decode(self, pageNo, data):
+        isLeaf, n, next_page, prev_page = INDEX_PAGE_HEADER.unpack_from(data)
+        offset = INDEX_PAGE_HEADER.size
+
+        if self.isStr:
+            keys = [bytes(data[offset+i*FIELD_LENGTH:offset+(i+1)*FIELD_LENGTH]).rstrip(b"\0").decode()
+                    for i in range(n)]
+        else:
+            keys = list(struct.unpack_from("<%dq" % n, data, offset))
+
+        if isLeaf:
+            offset += self.leafCapacity * self.keySize
+            values = list(struct.unpack_from("<%dQ" % n, data, offset))
+        else:
+            offset += self.nodeCapacity * self.keySize
+            values = list(struct.unpack_from("<%dI" % (n+1), data, offset))
+
+        node = IndexPage(pageNo, bool(isLeaf), keys, values, next_page, prev_page)
+        node.dirty = False
+        return node
+
+    def encode(self, node):
+        data = bytearray(PAGESIZE)
+        n = len(node.keys)
+        INDEX_PAGE_HEADER.pack_into(data, 0, node.isLeaf, n, node.next, node.prev)
+        offset = INDEX_PAGE_HEADER.size
+
+        if self.isStr:
+            data[offset:offset+n*FIELD_LENGTH] = b"".join(key.encode().ljust(FIELD_LENGTH, b"\0") for key in node.keys)
+        else:
+            struct.pack_into("<%dq" % n, data, offset, *node.keys)
+
+        if node.isLeaf:
+            offset += self.leafCapacity * self.keySize
+            struct.pack_into("<%dQ" % n, data, offset, *node.values)
+        else:
+            offset += self.nodeCapacity * self.keySize
+            struct.pack_into("<%dI" % len(node.values), data, offset, *node.values)
+        return data
+
+    def page(self, pageNo) -> IndexPage:
+        node = self.cache.get(pageNo)
+        if node is None:
+            node = self.decode(pageNo, self.file.readPage(pageNo))
+            self.cache[pageNo] = node
+        else:
+            self.cache.move_to_end(pageNo)
+        return node
+
+    def write(self, node):
+        logBeforeWrite()
+        if node.pageNo >= self.file.nofPages():
+            self.file.grow(max(node.pageNo + 1, 2*self.file.nofPages()))
+        self.file.writePage(node.pageNo, self.encode(node))
+        node.dirty = False
+
+    def trim(self):
+        """Evicts the least recently used nodes, writing the changed ones. Called between
+        operations so that the nodes an operation holds are never written half done."""
+        while len(self.cache) > self.cacheSize:
+            pageNo, node = self.cache.popitem(last=False)
+            if node.dirty:
+                self.write(node)
+
+    def allocate(self, isLeaf) -> IndexPage:
+        if self.freeHead != -1:
+            pageNo = self.freeHead
+            self.freeHead = self.page(pageNo).next
+        else:
+            pageNo = self.nofPages
+            self.nofPages += 1
+        node = IndexPage(pageNo, isLeaf)
+        self.cache[pageNo] = node
+        return node
+
+    def free(self, node):
+        node.isLeaf = True
+        node.keys = []
+        node.values = []
+        node.prev = -1
+        node.next = self.freeHead
+        node.dirty = True
+        self.freeHead = node.pageNo
+
+    def find(self, key) -> IndexPage:
+        node = self.page(self.root)
+        path = []
+        while not node.isLeaf:
+            path.append(node.pageNo)
+            node = self.page(node.values[bisect.bisect_right(node.keys, key)])
+        node.path = path
+        self.trim()
+        return node
+
+    def __contains__(self, key):
+        return self.find(key).position(key) >= 0
+
+    def query(self, key):
+        return self.find(key).getAddress(key)
+
+    def insert(self, key, value, leaf=None):
+        """
+        Returns:
+            (bool,IndexPage): the leaf where the key is inserted. return False if already has same key
+        """
+        if leaf is None or self.cache.get(leaf.pageNo) is not leaf:
+            leaf = self.find(key)
+        if leaf.position(key) >= 0:
+            return False, leaf
+
+        i = bisect.bisect_left(leaf.keys, key)
+        leaf.keys.insert(i, key)
+        leaf.values.insert(i, value)
+        leaf.dirty = True
+
+        if len(leaf.keys) > self.leafCapacity:
+            right = self.allocate(True)
+            mid = len(leaf.keys) // 2
+            right.keys = leaf.keys[mid:]
+            right.values = leaf.values[mid:]
+            del leaf.keys[mid:]
+            del leaf.values[mid:]
+
+            right.next = leaf.next
+            right.prev = leaf.pageNo
+            if leaf.next != -1:
+                next_leaf = self.page(leaf.next)
+                next_leaf.prev = right.pageNo
+                next_leaf.dirty = True
+            leaf.next = right.pageNo
+
+            self.insert_index(list(leaf.path), leaf.pageNo, right.keys[0], right.pageNo)
+
+        self.trim()
+        return True, leaf
+
+    def insert_index(self, path, leftNo, key, rightNo):
+        """Adds the pivot key of a split to the parent, splitting parents up the path as needed."""
+        while path:
+            parent = self.page(path.pop())
+            i = parent.values.index(leftNo)
+            parent.keys.insert(i, key)
+            parent.values.insert(i + 1, rightNo)
+            parent.dirty = True
+
+            if len(parent.keys) <= self.nodeCapacity:
+                return
+
+            right = self.allocate(False)
+            mid = len(parent.keys) // 2
+            key = parent.keys[mid]
+            right.keys = parent.keys[mid+1:]
+            right.values = parent.values[mid+1:]
+            del parent.keys[mid:]
+            del parent.values[mid+1:]
+            leftNo = parent.pageNo
+            rightNo = right.pageNo
+
+        root = self.allocate(False)
+        root.keys = [key]
+        root.values = [leftNo, rightNo]
+        self.root = root.pageNo
+        self.depth += 1
+
+    def delete(self, key, leaf=None):
+        if leaf is None or self.cache.get(leaf.pageNo) is not leaf:
+            leaf = self.find(key)
+        i = leaf.position(key)
+        if i < 0:
+            return False
+
+        del leaf.keys[i]
+        del leaf.values[i]
+        leaf.dirty = True
+
+        if len(leaf.keys) == 0 and leaf.path:
+            self.remove_node(leaf, list(leaf.path))
+
+        self.trim()
+        return True
+
+    def remove_node(self, node, path):
+        """Unlinks an empty node from its parent, and the parent too if that leaves it empty."""
+        while path:
+            if node.isLeaf:
+                if node.prev != -1:
+                    prev_leaf = self.page(node.prev)
+                    prev_leaf.next = node.next
+                    prev_leaf.dirty = True
+                if node.next != -1:
+                    next_leaf = self.page(node.next)
+                    next_leaf.prev = node.prev
+                    next_leaf.dirty = True
+
+            parent = self.page(path.pop())
+            i = parent.values.index(node.pageNo)
+            del parent.values[i]
+            if parent.keys:
+                del parent.keys[max(i - 1, 0)]
+            parent.dirty = True
+            self.free(node)
+
+            if parent.values:
+                break
+            node = parent
+
+        # an index root with a single child is replaced by that child
+        root = self.page(self.root)
+        while not root.isLeaf and len(root.values) == 1:
+            child = root.values[0]
+            self.free(root)
+            self.root = child
+            self.depth -= 1
+            root = self.page(child)
+
+    def leftmost_leaf(self) -> IndexPage:
+        node = self.page(self.root)
+        while not node.isLeaf:
+            node = self.page(node.values[0])
+        return node
+
+    def scan(self, low=None, high=None, includeLow=True, includeHigh=True):
+        """Same as BPlusTree.scan, reading the leaves one page at a time."""
+        if low is None:
+            leaf = self.leftmost_leaf()
+            i = 0
+        else:
+            leaf = self.find(low)
+            if includeLow:
+                i = bisect.bisect_left(leaf.keys, low)
+            else:
+                i = bisect.bisect_right(leaf.keys, low)
+
+        while True:
+            keys = leaf.keys
+            values = leaf.values
+            while i < len(keys):
+                key = keys[i]
+                if high is not None and (high < key or (key == high and not includeHigh)):
+                    return
+                yield key, values[i]
+                i = i + 1
+            if leaf.next == -1:
+                return
+            leaf = self.page(leaf.next)
+            i = 0
+            self.trim()
+
+    def last(self, high=None, includeHigh=True):
+        """Same as BPlusTree.last, following the prev page links."""
+        if high is None:
+            leaf = self.page(self.root)
+            while not leaf.isLeaf:
+                leaf = self.page(leaf.values[-1])
+            i = len(leaf.keys)
+        else:
+            leaf = self.find(high)
+            i = bisect.bisect_right(leaf.keys, high) if includeHigh else bisect.bisect_left(leaf.keys, high)
+
+        while i == 0:
+            if leaf.prev == -1:
+                return None
+            leaf = self.page(leaf.prev)
+            i = len(leaf.keys)
+        self.trim()
+        return leaf.keys[i-1], leaf.values[i-1]
+
+    def empty(self):
+        root = self.page(self.root)
+        return root.isLeaf and len(root.keys) == 0
+
+    def keys(self):
+        for key, value in self.scan():
+            yield key
+
+    def bulkLoad(self, items, fillFactor=1.0):
+        """Rewrites the index from sorted (key, value) pairs. Leaves go to consecutive pages,
+        then each index level is written above them."""
+        self.cache.clear()
+        self.freeHead = -1
+        self.nofPages = 1
+        self.depth = 0
+
+        size = min(self.leafCapacity, max(1, int(self.leafCapacity * fillFactor)))
+        groups = partition(len(items), size, 1) if items else [0]
+        firstLeaf = self.nofPages
+        pageNos = []
+        lows = []
+        start = 0
+        for j, count in enumerate(groups):
+            leaf = IndexPage(self.nofPages, True)
+            leaf.keys = [key for key, value in items[start:start+count]]
+            leaf.values = [value for key, value in items[start:start+count]]
+            leaf.prev = leaf.pageNo - 1 if j > 0 else -1
+            leaf.next = leaf.pageNo + 1 if j < len(groups) - 1 else -1
+            self.write(leaf)
+            pageNos.append(leaf.pageNo)
+            lows.append(leaf.keys[0] if count else None)
+            self.nofPages += 1
+            start += count
+
+        size = min(self.nodeCapacity + 1, max(2, int(self.nodeCapacity * fillFactor) + 1))
+        while len(pageNos) > 1:
+            parents = []
+            parentLows = []
+            start = 0
+            for count in partition(len(pageNos), size, 2):
+                node = IndexPage(self.nofPages, False)
+                node.values = pageNos[start:start+count]
+                node.keys = lows[start+1:start+count]
+                self.write(node)
+                parents.append(node.pageNo)
+                parentLows.append(lows[start])
+                self.nofPages += 1
+                start += count
+            pageNos = parents
+            lows = parentLows
+            self.depth += 1
+
+        self.root = pageNos[0] if pageNos else firstLeaf
+        self.writeMeta()
+
+    def flush(self):
+        for node in self.cache.values():
+            if node.dirty:
+                self.write(node)
+        self.writeMeta()
+        self.file.flush()
+
+    def close(self):
+        self.flush()
+        self.cache.clear()
+        self.file.close()
+
+
+class FreeSpaceMap(object):
+    """Tracks the used record slots of every page of a type's data files, so that an insert
+    finds a free slot without reading page and record headers.
+    Attributes:
+        pages (dict): (fileName, pageNo) -> bitmap of the used slots of the page
+        withRoom (list): pages that have at least one free slot, the next one to fill is last
+    """
+
+    def __init__(self, lengthOfARecord, pagesInAFile=PAGE_IN_A_FILE):
+        self.lengthOfARecord: int = lengthOfARecord
+        self.pagesInAFile: int = pagesInAFile
+        self.recordsInAPage: int = int(math.floor((PAGESIZE-1)/(lengthOfARecord+1)))
+        self.full: int = (1 << self.recordsInAPage) - 1
+        self.pages: dict = {}
+        self.withRoom: list = []
+        self.roomSet: set = set()
+
+    def recordLocation(self, pageNo, slot):
+        """Byte offset of the record header of slot in pageNo."""
+        return pageNo*PAGESIZE + 1 + slot*(self.lengthOfARecord+1)
+
+    def addFile(self, fileName, bitmaps=None):
+        """Registers a data file. bitmaps holds the used slots of each page, a new file is empty."""
+        if bitmaps is None:
+            bitmaps = [0] * self.pagesInAFile
+        for pageNo in reversed(range(len(bitmaps))):
+            self.pages[(fileName, pageNo)] = bitmaps[pageNo]
+            if bitmaps[pageNo] != self.full:
+                self.withRoom.append((fileName, pageNo))
+                self.roomSet.add((fileName, pageNo))
+
+    def readFile(self, fileName):
+        """Registers an existing data file by reading its record headers once."""
+        bufferPool.writeBackFile(fileName)
+        data = bufferPool.file(fileName).map
+
+        bitmaps = []
+        for pageNo in range(len(data) // PAGESIZE):
+            bitmap = 0
+            for slot in range(self.recordsInAPage):
+                if data[self.recordLocation(pageNo, slot)] == ord("1"):
+                    bitmap |= 1 << slot
+            bitmaps.append(bitmap)
+        del data
+        bufferPool.file(fileName).release()
+        self.addFile(fileName, bitmaps)
+
+    def allocate(self):
+        """Marks a free slot as used.
+        Returns:
+            (str,int,int): file name, page number and slot. None if every page is full
+        """
+        if not self.withRoom:
+            return None
+
+        page = self.withRoom[-1]
+        bitmap = self.pages[page]
+        slot = (~bitmap & (bitmap + 1)).bit_length() - 1
+        bitmap |= 1 << slot
+        self.pages[page] = bitmap
+
+        if bitmap == self.full:
+            self.withRoom.pop()
+            self.roomSet.discard(page)
+
+        return page[0], page[1], slot
+
+    def release(self, fileName, pageNo, slot):
+        page = (fileName, pageNo)
+        self.pages[page] &= ~(1 << slot)
+        if page not in self.roomSet:
+            self.withRoom.append(page)
+            self.roomSet.add(page)
+
+    def isFull(self, fileName, pageNo):
+        return self.pages[(fileName, pageNo)] == self.full
+
+    def segments(self):
+        """Returns the data files in the order they were added, each with its used and total record slots."""
+        used = {}
+        slots = {}
+        for (fileName, pageNo), bitmap in self.pages.items():
+            used[fileName] = used.get(fileName, 0) + bin(bitmap).count("1")
+            slots[fileName] = slots.get(fileName, 0) + self.recordsInAPage
+        return [(fileName, used[fileName], slots[fileName]) for fileName in used]
+
+    def dumps(self):
+        files = {}
+        for (fileName, pageNo), bitmap in self.pages.items():
+            bitmaps = files.setdefault(fileName, [])
+            bitmaps.extend([0] * (pageNo + 1 - len(bitmaps)))
+            bitmaps[pageNo] = bitmap
+        return json.dumps({"lengthOfARecord": self.lengthOfARecord, "files": files})
+
+
+class DataFile(object):
+    """A <type>_<n>.txt data file mapped into memory in binary mode. Pages are copied out of
+    and back into the mapping, which replaces a seek and a read or write call per page.
+    """
+
+    def __init__(self, fileName):
+        self.fileName: str = fileName
+        self.file = open(fileName, "r+b")
+        self.map = mmap.mmap(self.file.fileno(), 0)
+        self.view = memoryview(self.map)
+
+    def nofPages(self):
+        return len(self.map) // PAGESIZE
+
+    def readPage(self, pageNo) -> memoryview:
+        return self.view[pageNo*PAGESIZE:(pageNo+1)*PAGESIZE]
+
+    def writePage(self, pageNo, page):
+        self.view[pageNo*PAGESIZE:(pageNo+1)*PAGESIZE] = page
+
+    def grow(self, nofPages):
+        """Extends the file with zeroed pages up to nofPages and maps it again."""
+        self.view.release()
+        self.map.close()
+        self.file.truncate(nofPages*PAGESIZE)
+        self.map = mmap.mmap(self.file.fileno(), 0)
+        self.view = memoryview(self.map)
+
+    def flush(self):
+        self.map.flush()
+
+    def release(self):
+        """Called when a scan is done with map. A mapping holds nothing that needs freeing."""
+        pass
+
+    def close(self):
+        self.view.release()
+        self.map.close()
+        self.file.close()
+
+
+class CompressedDataFile(object):
+    """A data file whose pages were compressed one by one. After the header comes the page
+    index, the offset of every compressed page and the end of the last one, so a page is read
+    by decompressing only that page. map and view decompress the whole file for a scan, which
+    calls release when it is done so that the copy is not kept. The first write turns it back into a plain DataFile, which it then passes every call to.
+    Attributes:
+        codecName (str): zlib or lzma
+        offsets (tuple): start of each compressed page, followed by the end of the file
+        plain (DataFile): the file once it was written to, None while it is compressed
+    """
+
+    def __init__(self, fileName):
+        self.fileName: str = fileName
+        self.file = open(fileName, "rb")
+        self.data = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, codecName, nofPages = COMPRESSED_HEADER.unpack_from(self.data)
+        self.codecName: str = codecName.decode()
+        self.codec = COMPRESSION_CODECS[self.codecName]
+        self.offsets: tuple = struct.unpack_from("<%dI" % (nofPages + 1), self.data, COMPRESSED_HEADER.size)
+        self.image = None
+        self.plain = None
+
+    def nofPages(self):
+        if self.plain is not None:
+            return self.plain.nofPages()
+        return len(self.offsets) - 1
+
+    def readPage(self, pageNo):
+        if self.plain is not None:
+            return self.plain.readPage(pageNo)
+        if self.image is not None:
+            return memoryview(self.image)[pageNo*PAGESIZE:(pageNo+1)*PAGESIZE]
+        return self.codec.decompress(self.data[self.offsets[pageNo]:self.offsets[pageNo+1]])
+
+    @property
+    def map(self):
+        if self.plain is not None:
+            return self.plain.map
+        if self.image is None:
+            self.image = bytearray(b"".join(self.readPage(pageNo) for pageNo in range(self.nofPages())))
+        return self.image
+
+    @property
+    def view(self) -> memoryview:
+        if self.plain is not None:
+            return self.plain.view
+        return memoryview(self.map)
+
+    def writePage(self, pageNo, page):
+        self.thaw()
+        self.plain.writePage(pageNo, page)
+
+    def grow(self, nofPages):
+        self.thaw()
+        self.plain.grow(nofPages)
+
+    def thaw(self):
+        """Writes the pages back uncompressed. The new file replaces the old one in a rename,
+        so a crash leaves one of the two."""
+        if self.plain is not None:
+            return
+        image = self.map
+        writeFileAtomically(self.fileName, image)
+        self.image = None
+        self.data.close()
+        self.file.close()
+        self.plain = DataFile(self.fileName)
+
+    def flush(self):
+        if self.plain is not None:
+            self.plain.flush()
+
+    def release(self):
+        """Drops the decompressed copy of the file, later reads decompress single pages again."""
+        self.image = None
+
+    def close(self):
+        if self.plain is not None:
+            self.plain.close()
+        else:
+            self.data.close()
+            self.file.close()
+
+
+def openDataFile(fileName):
+    """Opens a data file, as a CompressedDataFile if it starts with COMPRESSED_MAGIC."""
+    file = open(fileName, "rb")
+    magic = file.read(len(COMPRESSED_MAGIC))
+    file.close()
+    if magic == COMPRESSED_MAGIC:
+        return CompressedDataFile(fileName)
+    return DataFile(fileName)
+
+def compressedImage(dataFile, codecName):
+    """Returns the pages of a data file compressed one by one, behind the header and the page index."""
+    codec = COMPRESSION_CODECS[codecName]
+    pages = [codec.compress(bytes(dataFile.readPage(pageNo))) for pageNo in range(dataFile.nofPages())]
+    offsets = [COMPRESSED_HEADER.size + 4*(len(pages) + 1)]
+    for page in pages:
+        offsets.append(offsets[-1] + len(page))
+    return b"".join([COMPRESSED_HEADER.pack(COMPRESSED_MAGIC, codecName.encode(), len(pages)),
+                     struct.pack("<%dI" % len(offsets), *offsets)] + pages)
+
+def writeFileAtomically(fileName, data):
+    """Writes data to a temporary file, syncs it and renames it over fileName, then syncs the
+    directory so that the rename is on disk too."""
+    file = open(fileName + ".tmp", "wb")
+    file.write(data)
+    file.flush()
+    os.fsync(file.fileno())
+    file.close()
+    os.replace(fileName + ".tmp", fileName)
+    directory = os.open(os.path.dirname(os.path.abspath(fileName)), os.O_RDONLY)
+    os.fsync(directory)
+    os.close(directory)
+
+
+class TextRecordFormat(object):
+    """The fixed-width text record layout: every field is padded with spaces to FIELD_LENGTH bytes."""
+
+    def __init__(self, nofFields):
+        self.nofFields: int = nofFields
+        self.length: int = nofFields * FIELD_LENGTH
+        self.fields = struct.Struct(("%ds" % FIELD_LENGTH) * nofFields)
+
+    def fits(self, fields):
+        """False if a field is longer than FIELD_LENGTH, which would overwrite its neighbour."""
+        if len(fields) > self.nofFields:
+            return False
+        for field in fields:
+            if len(field.encode()) > FIELD_LENGTH:
+                return False
+        return True
+
+    def pack_into(self, buffer, offset, fields):
+        """Writes fields into buffer at offset. An update may give fewer fields than the type has.
+        Fields are padded after encoding, so that a multi-byte character does not make a field
+        longer than FIELD_LENGTH bytes."""
+        data = b"".join(field.encode().ljust(FIELD_LENGTH) for field in fields)
+        buffer[offset:offset+len(data)] = data
+
+    def view(self, buffer, offset) -> memoryview:
+        """Zero-copy view of the record stored at offset."""
+        return memoryview(buffer)[offset:offset+self.length]
+
+    def unpack(self, record):
+        """Returns the fields of a record view as strings. Fields are cut at FIELD_LENGTH, as a
+        field that fills its width is not followed by a space."""
+        return [field.rstrip(b" ").decode() for field in self.fields.unpack_from(record)]
+
+    def decodeField(self, buffer, offset, fieldNo):
+        """Returns one field of the record stored at offset, without decoding the others."""
+        start = offset + fieldNo*FIELD_LENGTH
+        return bytes(buffer[start:start+FIELD_LENGTH]).rstrip(b" ").decode()
+
+    def joinFields(self, fields):
+        """The fields as a command writes them, separated by spaces."""
+        return " ".join(fields)
+
+
+class BinaryRecordFormat(object):
+    """The format=binary record layout: a null bitmap, then every int field as an 8 byte
+    integer and every str field as a length byte followed by FIELD_LENGTH bytes. A field
+    written as None or an empty string is null, and reads back as None. A null field has no
+    value to compare, so filters, indexes and aggregates leave it out.
+    Attributes:
+        offsets (list): where each field starts within the record
+        codes (list): the struct of each field
+    """
+
+    def __init__(self, fieldTypes):
+        self.fieldTypes: list = list(fieldTypes)
+        self.nofFields: int = len(self.fieldTypes)
+        self.bitmapLength: int = (self.nofFields + 7) // 8
+        self.codes: list = [struct.Struct("<q" if fieldType == "int" else "<B%ds" % FIELD_LENGTH)
+                            for fieldType in self.fieldTypes]
+        self.offsets: list = []
+        offset = self.bitmapLength
+        for code in self.codes:
+            self.offsets.append(offset)
+            offset += code.size
+        self.length: int = offset
+        self.fields = struct.Struct("<%ds" % self.bitmapLength + "".join(code.format[1:] for code in self.codes))
+
+    def fits(self, fields):
+        """False if a str field is longer than FIELD_LENGTH bytes or an int field is not a 64 bit integer."""
+        if len(fields) > self.nofFields:
+            return False
+        for fieldType, field in zip(self.fieldTypes, fields):
+            if field is None or field == "":
+                continue
+            if fieldType != "int":
+                if len(field.encode()) > FIELD_LENGTH:
+                    return False
+                continue
+            try:
+                encodeKey("int", field)
+            except ValueError:
+                return False
+        return True
+
+    def pack_into(self, buffer, offset, fields):
+        """Writes fields into buffer at offset. An update may give fewer fields than the type
+        has, the others keep their values."""
+        if len(fields) < self.nofFields:
+            record = self.view(buffer, offset)
+            fields = list(fields) + self.unpack(record)[len(fields):]
+            record.release()
+
+        bitmap = 0
+        values = []
+        for fieldNo, (fieldType, field) in enumerate(zip(self.fieldTypes, fields)):
+            if field is None or field == "":
+                bitmap |= 1 << fieldNo
+                values.extend([0] if fieldType == "int" else [0, b""])
+            elif fieldType == "int":
+                values.append(int(field))
+            else:
+                data = field.encode()
+                values.extend([len(data), data])
+        self.fields.pack_into(buffer, offset, bitmap.to_bytes(self.bitmapLength, "little"), *values)
+
+    def view(self, buffer, offset) -> memoryview:
+        """Zero-copy view of the record stored at offset."""
+        return memoryview(buffer)[offset:offset+self.length]
+
+    def unpack(self, record):
+        """Returns the fields of a record view as strings, None for a null field."""
+        values = self.fields.unpack_from(record)
+        bitmap = int.from_bytes(values[0], "little")
+        fields = []
+        i = 1
+        for fieldNo, fieldType in enumerate(self.fieldTypes):
+            if fieldType == "int":
+                field = str(values[i])
+                i += 1
+            else:
+                field = values[i+1][:values[i]].decode()
+                i += 2
+            fields.append(None if bitmap >> fieldNo & 1 else field)
+        return fields
+
+    def decodeField(self, buffer, offset, fieldNo):
+        """Returns one field of the record stored at offset, without decoding the others."""
+        if buffer[offset + fieldNo // 8] >> (fieldNo % 8) & 1:
+            return None
+        value = self.codes[fieldNo].unpack_from(buffer, offset + self.offsets[fieldNo])
+        if self.fieldTypes[fieldNo] == "int":
+            return str(value[0])
+        return value[1][:value[0]].decode()
+
+    def joinFields(self, fields):
+        """The fields as a command writes them, separated by spaces. A null field is written empty."""
+        return " ".join(["" if field is None else field for field in fields])
+
+
+class BufferPool(object):
+    """Keeps data file pages in memory, keyed by (fileName, pageNo).
+    A page is pinned while an operation uses it. When the pool is full the least recently
+    used unpinned page is evicted, and written back first if it is dirty.
+    Attributes:
+        capacity (int): number of pages the pool holds
+        hits (int): page requests served from memory
+        misses (int): page requests that read the data file
+    """
+
+    def __init__(self, capacity=BUFFER_POOL_PAGES):
+        self.capacity: int = capacity
+        self.frames = collections.OrderedDict()
+        self.pins: dict = {}
+        # changed pages, with the number of log records there were when they last changed
+        self.dirty: dict = {}
+        self.files: dict = {}
+        self.hits: int = 0
+        self.misses: int = 0
+        self.evictions: int = 0
+
+    def file(self, fileName) -> DataFile:
+        if fileName not in self.files:
+            self.files[fileName] = openDataFile(fileName)
+        return self.files[fileName]
+
+    def pin(self, fileName, pageNo) -> bytearray:
+        """Returns the page, reading it if it is not in the pool. Every pin needs an unpin."""
+        key = (fileName, pageNo)
+        frame = self.frames.get(key)
+
+        if frame is None:
+            self.misses += 1
+            self.evict()
+            frame = bytearray(self.file(fileName).readPage(pageNo))
+            self.frames[key] = frame
+        else:
+            self.hits += 1
+            self.frames.move_to_end(key)
+
+        self.pins[key] = self.pins.get(key, 0) + 1
+        return frame
+
+    def unpin(self, fileName, pageNo, dirty=False):
+        key = (fileName, pageNo)
+        self.pins[key] -= 1
+        if self.pins[key] == 0:
+            del self.pins[key]
+        if dirty:
+            self.dirty[key] = writeAheadLog.records if writeAheadLog is not None else 0
+
+    def evict(self):
+        """Makes room for one page. Pinned pages stay, the pool overflows if all are pinned."""
+        if len(self.frames) < self.capacity:
+            return
+        for key in self.frames:
+            if key not in self.pins:
+                self.writeBack(key)
+                del self.frames[key]
+                self.evictions += 1
+                return
+
+    def writeBack(self, key):
+        if key in self.dirty:
+            logBeforeWrite(self.dirty.pop(key))
+            self.file(key[0]).writePage(key[1], self.frames[key])
+
+    def flush(self):
+        for key in list(self.dirty):
+            self.writeBack(key)
+        for f in self.files.values():
+            f.flush()
+
+    def writeBackFile(self, fileName):
+        """Copies the changed pages of a file into its mapping, so that the file can be read
+        directly without going through the pool."""
+        for key in [key for key in self.dirty if key[0] == fileName]:
+            self.writeBack(key)
+
+    def dropFile(self, fileName):
+        """Forgets the pages of a file that is about to be removed, without writing them."""
+        for key in [key for key in self.frames if key[0] == fileName]:
+            del self.frames[key]
+            self.dirty.pop(key, None)
+            self.pins.pop(key, None)
+        if fileName in self.files:
+            self.files.pop(fileName).close()
+
+    def close(self):
+        self.flush()
+        for f in self.files.values():
+            f.close()
+        self.files = {}
+
+    def stats(self):
+        requests = self.hits + self.misses
+        ratio = self.hits / requests if requests else 0
+        return "buffer pool: {} pages, {} hits, {} misses, {} evictions, hit ratio {:.2%}".format(
+            self.capacity, self.hits, self.misses, self.evictions, ratio)
+
+
+class WriteAheadLog(object):
+    """Log of the record changes made since the last checkpoint, one per line as the change,
+    type name, record address and the fields written, separated by spaces like a command
+    (see encodeLogField for null fields).
+    A change is appended before it is made and the log is synced a group at a time: after
+    groupSize changes, once window seconds have passed (checked at every change and between
+    commands), and before a changed data page or index reaches its file. A clean exit checkpoints, which empties the
+    log, and a log that is not empty at startup is replayed by replayLog.
+    Attributes:
+        records (int): changes logged in this run
+        committed (int): changes logged in this run that are synced
+        commits (int): times the log was synced
+    """
+
+    def __init__(self, fileName=WAL_FILE, groupSize=WAL_GROUP_SIZE, window=WAL_GROUP_WINDOW):
+        self.fileName: str = fileName
+        self.groupSize: int = max(1, groupSize)
+        self.window: float = window
+        self.file = open(fileName, "a", encoding="utf-8")
+        self.pending: list = []
+        self.lastCommit: float = time.monotonic()
+        self.records: int = 0
+        self.committed: int = 0
+        self.commits: int = 0
+
+    def append(self, op, type_name, address=0, fields=()):
+        """Logs a change: create, update or delete of the record at address, load of new data
+        files or drop of the type."""
+        self.pending.append(" ".join([op, type_name, str(address)] + [encodeLogField(field) for field in fields]))
+        self.records += 1
+        if len(self.pending) >= self.groupSize:
+            self.commit()
+        else:
+            self.poll()
+
+    def poll(self):
+        """Commits the pending changes if window seconds have passed since the last commit."""
+        if self.pending and time.monotonic() - self.lastCommit >= self.window:
+            self.commit()
+
+    def commit(self):
+        """Writes and syncs the pending changes, once for the whole group."""
+        if not self.pending:
+            return
+        self.file.write("\n".join(self.pending) + "\n")
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.pending = []
+        self.lastCommit = time.monotonic()
+        self.committed = self.records
+        self.commits += 1
+
+    def checkpoint(self):
+        """Empties the log, once every change it holds is in the data files and the saved indexes."""
+        self.pending = []
+        self.file.truncate(0)
+        self.file.flush()
+        os.fsync(self.file.fileno())
+
+    def close(self):
+        self.file.close()
+
+    def stats(self):
+        return "write-ahead log: {} records, {} commits".format(self.records, self.commits)
+
+
+def encodeLogField(field):
+    """A null field is logged as WAL_NULL, and a field that starts with a backslash gets one
+    more in front, so that decodeLogField can tell them apart."""
+    if field is None or field == "":
+        return WAL_NULL
+    if field[0] == "\\":
+        return "\\" + field
+    return field
+
+def decodeLogField(word):
+    if word == WAL_NULL:
+        return None
+    if word[0] == "\\":
+        return word[1:]
+    return word
+
+def logBeforeWrite(records=None):
+    """Syncs the log before a changed page or index is written, so that a file never holds
+    a change that the log could lose. A data page gives the number of log records there
+    were when it last changed, and the log is only synced if some of those are not yet."""
+    if writeAheadLog is not None and (records is None or records > writeAheadLog.committed):
+        writeAheadLog.commit()
+
+
+class TypeSchema(object):
+    """Parsed catalog record of a type.
+    Attributes:
+        fieldNames (list): field names in record order
+        fieldTypes (list): declared type (int or str) of each field
+        files (list): data files of the type, the last one is the newest
+        options (dict): optional per-type settings given as key=value words to create type
+    """
+
+    def __init__(self, type_name, nof_fields, prim_key_order, fieldsAndTypes, files, options=None):
+        self.name: str = type_name
+        self.nofFields: int = nof_fields
+        self.primKeyOrder: int = prim_key_order
+        self.fieldsAndTypes: list = fieldsAndTypes
+        self.fieldNames: list = fieldsAndTypes[0::2]
+        self.fieldTypes: list = fieldsAndTypes[1::2]
+        self.primKeyName: str = self.fieldNames[prim_key_order-1]
+        self.primKeyType: str = self.fieldTypes[prim_key_order-1]
+        self.options: dict = options if options is not None else {}
+        if self.options.get("format") == "binary":
+            self.recordFormat = BinaryRecordFormat(self.fieldTypes)
+        else:
+            self.recordFormat = TextRecordFormat(nof_fields)
+        self.lengthOfARecord: int = self.recordFormat.length
+        self.recordsInAPage: int = int(math.floor((PAGESIZE-1)/(self.lengthOfARecord+1)))
+        self.files: list = files
+
+    def fanout(self):
+        return int(self.options.get("fanout", BTREE_FANOUT))
+
+    def pagesInAFile(self):
+        """Pages of each new data file, set with pages=N when the type is created."""
+        return int(self.options.get("pages", PAGE_IN_A_FILE))
+
+    def dataFile(self, fileNo):
+        return self.name + "_" + str(fileNo) + ".txt"
+
+    def fileNo(self, fileName):
+        return int(fileName[len(self.name)+1:-len(".txt")])
+
+    def recordOffset(self, slot):
+        """Offset of the record header of slot within its page."""
+        return 1 + slot*(self.lengthOfARecord+1)
+
+    def addressOfByte(self, fileNo, byte):
+        """Converts an address of the JSON indexes of the first versions, the byte offset of the
+        record's first field."""
+        pageNo = byte // PAGESIZE
+        return packAddress(fileNo, pageNo, (byte - pageNo*PAGESIZE - 2) // (self.lengthOfARecord+1))
+
+    def fieldIndex(self, field_name):
+        """Returns the position of field_name in a record, -1 if the type has no such field."""
+        if field_name in self.fieldNames:
+            return self.fieldNames.index(field_name)
+        return -1
+
+    def fieldType(self, field_name):
+        return self.fieldTypes[self.fieldIndex(field_name)]
+
+    def indexedFields(self):
+        """Fields with a secondary index, kept in the catalog as indexes=field1+field2."""
+        return [field for field in self.options.get("indexes", "").split("+") if field != ""]
+
+    def setIndexedFields(self, fields):
+        if fields:
+            self.options["indexes"] = "+".join(fields)
+        else:
+            self.options.pop("indexes", None)
+
+    def line(self):
+        words = [self.name, str(self.nofFields), str(self.primKeyOrder), str(self.fieldsAndTypes)]
+        words += self.files
+        words += [key + "=" + str(value) for key, value in self.options.items()]
+        return ",".join(words) + "\n"
+
+
+class SystemCatalog(object):
+    """systemCatalog.csv parsed once. Every change is written through to the file.
+    A line is: name,nof_fields,prim_key_order,[fields and types],data files...,options...
+    """
+
+    def __init__(self, fileName):
+        self.fileName: str = fileName
+        self.types: dict = {}
+
+        if os.path.exists(fileName):
+            file = open(fileName)
+            for line in file.readlines():
+                if line.strip() != "":
+                    schema = self.parse(line)
+                    self.types[schema.name] = schema
+            file.close()
+
+    def parse(self, line):
+        head = line[:line.index("[")].split(",")
+        fieldsAndTypes = ast.literal_eval(line[line.index("["):line.index("]") + 1])
+        files = []
+        options = {}
+
+        for word in line[line.index("]") + 1:].strip().split(","):
+            if "=" in word:
+                options[word.split("=")[0]] = word.split("=")[1]
+            elif word != "":
+                files.append(word)
+
+        type_name = head[0]
+        if len(files) == 1:
+            # older catalogs only kept the newest file, the earlier ones are numbered before it
+            lastNo = int(files[0][len(type_name)+1:-len(".txt")])
+            files = [type_name + "_" + str(i) + ".txt" for i in range(1, lastNo)
+                     if os.path.exists(type_name + "_" + str(i) + ".txt")] + files
+
+        return TypeSchema(type_name, int(head[1]), int(head[2]), fieldsAndTypes, files, options)
+
+    def __contains__(self, type_name):
+        return type_name in self.types
+
+    def __getitem__(self, type_name) -> TypeSchema:
+        return self.types[type_name]
+
+    def names(self):
+        return list(self.types)
+
+    def add(self, schema):
+        self.types[schema.name] = schema
+        file = open(self.fileName, "a")
+        file.write(schema.line())
+        file.flush()
+        os.fsync(file.fileno())
+        file.close()
+
+    def remove(self, type_name):
+        del self.types[type_name]
+        self.save()
+
+    def save(self):
+        writeFileAtomically(self.fileName, "".join(schema.line() for schema in self.types.values()).encode())
+
+
+class IndexCache(object):
+    """The B+ trees of the types, each loaded from its snapshot the first time a command uses
+    the type. A primary index is named by its type name and a secondary index by a
+    (type name, field name) pair. With a budget, once the loaded in-memory trees hold more than budget keys the
+    least recently used ones are written to their snapshots and unloaded. Paged trees keep
+    their own small page cache and do not count against the budget.
+    """
+
+    def __init__(self, budget=INDEX_BUDGET):
+        self.budget: int = budget
+        self.trees = collections.OrderedDict()
+        self.loads: int = 0
+        self.evictions: int = 0
+
+    def __contains__(self, name):
+        """True if the tree is loaded."""
+        return name in self.trees
+
+    def __getitem__(self, name):
+        tree = self.trees.get(name)
+        if tree is None:
+            if type(name) is tuple:
+                tree = loadSecondaryIndex(catalog[name[0]], name[1])
+            else:
+                tree = loadBTree(catalog[name])
+            self.loads += 1
+            self[name] = tree
+        elif next(reversed(self.trees)) != name:
+            # trees grow between loads, so the budget is checked whenever the tree in use changes
+            self[name] = tree
+        return tree
+
+    def __setitem__(self, name, tree):
+        self.trees[name] = tree
+        self.trees.move_to_end(name)
+        self.evict()
+
+    def drop(self, name):
+        """Forgets a tree without saving it. Dropping a type drops its secondary indexes too."""
+        for key in [key for key in self.trees if key == name or (type(key) is tuple and key[0] == name)]:
+            tree = self.trees.pop(key)
+            if isinstance(tree, PagedBPlusTree):
+                tree.close()
+
+    def evict(self):
+        if self.budget <= 0:
+            return
+        total = sum(tree.size for tree in self.trees.values() if isinstance(tree, BPlusTree))
+        # the most recently used tree stays even if it is over the budget by itself
+        for name in list(self.trees)[:-1]:
+            if total <= self.budget:
+                return
+            tree = self.trees[name]
+            if isinstance(tree, BPlusTree):
+                saveBTree(name, tree)
+                del self.trees[name]
+                total -= tree.size
+                self.evictions += 1
+
+    def items(self):
+        return list(self.trees.items())
+
+    def stats(self):
+        return "indexes: {} loaded, {} unloaded".format(self.loads, self.evictions)
+
+
+class ResultCache(object):
+    """Output of the read commands, keyed by the command words and kept with the version of
+    the type it was computed from. A write to the type changes its version, so an entry of
+    an older version is never served. The least recently used entries go once there are more
+    than capacity of them or their output is longer than size characters in total.
+    """
+
+    def __init__(self, capacity=RESULT_CACHE_ENTRIES, size=RESULT_CACHE_SIZE):
+        self.capacity: int = capacity
+        self.size: int = size
+        self.entries = collections.OrderedDict()
+        self.used: int = 0
+        self.hits: int = 0
+        self.misses: int = 0
+
+    def get(self, type_name, key):
+        """Returns the (output, success) stored for key, None if there is no current one."""
+        entry = self.entries.get(key)
+        if entry is not None and entry[0] == typeVersions[type_name]:
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[1], entry[2]
+        if entry is not None:
+            self.remove(key)
+        self.misses += 1
+        return None
+
+    def put(self, type_name, key, output, success):
+        if self.capacity <= 0 or len(output) > self.size:
+            return
+        if key in self.entries:
+            self.remove(key)
+        self.entries[key] = (typeVersions[type_name], output, success)
+        self.used += len(output)
+        while len(self.entries) > self.capacity or self.used > self.size:
+            self.remove(next(iter(self.entries)))
+
+    def remove(self, key):
+        self.used -= len(self.entries.pop(key)[1])
+
+    def stats(self):
+        requests = self.hits + self.misses
+        ratio = self.hits / requests if requests else 0
+        return "result cache: {} hits, {} misses, hit ratio {:.2%}".format(self.hits, self.misses, ratio)
+
+
+class CachedOutput(object):
+    """Writes the output of a read command through to the output file, and keeps a copy of
+    it for the result cache until the copy is longer than limit characters."""
+
+    def __init__(self, outputFile, limit):
+        self.outputFile = outputFile
+        self.limit: int = limit
+        self.parts: list = []
+        self.length: int = 0
+
+    def write(self, text):
+        self.outputFile.write(text)
+        if self.parts is not None:
+            self.length += len(text)
+            if self.length > self.limit:
+                self.parts = None
+            else:
+                self.parts.append(text)
+
+    def getvalue(self):
+        """The copy, None if the output was too long to keep."""
+        return "".join(self.parts) if self.parts is not None else None
+
+
+def cachedQuery(type_name, words, query, outputFile):
+    """Runs query(output) for a read command, writing straight to outputFile, or writes the
+    output stored for it in resultCache.
+    Returns:
+        bool: whether the command succeeded
+    """
+    key = (words[0].lower(), words[1].lower()) + tuple(words[2:])
+    cached = resultCache.get(type_name, key)
+    if cached is not None:
+        outputFile.write(cached[0])
+        return cached[1]
+
+    output = CachedOutput(outputFile, resultCache.size)
+    success = query(output)
+    if output.getvalue() is not None:
+        resultCache.put(type_name, key, output.getvalue(), success)
+    return success
+
+
+class FreeSpaceMaps(dict):
+    """Free-space maps by type name, each loaded the first time it is used."""
+
+    def __missing__(self, type_name):
+        fsm = loadFreeSpaceMap(catalog[type_name])
+        self[type_name] = fsm
+        return fsm
+
+
+class Histogram(object):
+    """Equi-depth histogram of the values of a field: bounds[i] is the value at the
+    i/HISTOGRAM_BUCKETS quantile, so every bucket holds about the same number of values.
+    The values are read once as they stream by, without keeping them."""
+
+    def __init__(self, values, n):
+        """:type values: iterable of the n values in sorted order"""
+        positions = [i*(n-1)//HISTOGRAM_BUCKETS for i in range(HISTOGRAM_BUCKETS+1)] if n > 0 else []
+        self.bounds: list = []
+        self.distinct: int = 0
+        self.count: int = 0
+        previous = None
+        for value in values:
+            if self.count == 0 or value != previous:
+                self.distinct += 1
+            while len(self.bounds) < len(positions) and positions[len(self.bounds)] == self.count:
+                self.bounds.append(value)
+            previous = value
+            self.count += 1
+        if self.count and len(self.bounds) < len(positions):
+            # n was more than the values there were, the last buckets end at the last value
+            self.bounds.extend([previous] * (len(positions) - len(self.bounds)))
+
+    def below(self, value):
+        """Estimated share of the values that are less than value."""
+        bounds = self.bounds
+        if not bounds or value <= bounds[0]:
+            return 0.0
+        if value > bounds[-1]:
+            return 1.0
+        i = bisect.bisect_left(bounds, value) - 1
+        within = 0.5
+        if type(value) is int and bounds[i+1] != bounds[i]:
+            within = (value - bounds[i]) / (bounds[i+1] - bounds[i])
+        return (i + within) / HISTOGRAM_BUCKETS
+
+    def fraction(self, low, high):
+        """Estimated share of the values between low and high, None leaves a side open."""
+        if low is not None and low == high:
+            if not self.bounds or low < self.bounds[0] or low > self.bounds[-1]:
+                return 0.0
+            return 1.0 / self.distinct
+        upper = 1.0 if high is None else self.below(high)
+        lower = 0.0 if low is None else self.below(low)
+        return max(0.0, upper - lower)
+
+
+class TypeStatistics(object):
+    """What the planner knows about a type, gathered from its free-space map and indexes.
+    Attributes:
+        nofRecords (int): records of the type
+        nofPages (int): pages of its data files, all of which a full scan reads
+        pagesInUse (int): pages that hold at least one record
+        histograms (dict): field name -> Histogram, for the primary key and the indexed fields
+        version (int): typeVersions of the type when the statistics were gathered
+    """
+
+    def __init__(self, schema):
+        fsm = freeSpaceMaps[schema.name]
+        self.nofRecords: int = sum(bin(bitmap).count("1") for bitmap in fsm.pages.values())
+        self.nofPages: int = len(fsm.pages)
+        self.pagesInUse: int = sum(1 for bitmap in fsm.pages.values() if bitmap)
+
+        b_tree = bTrees[schema.name]
+        self.depth: int = b_tree.depth
+        self.paged: bool = isinstance(b_tree, PagedBPlusTree)
+        # a paged index does not count its keys, every record has one so the free-space map does
+        size = b_tree.size if isinstance(b_tree, BPlusTree) else self.nofRecords
+        self.histograms: dict = {schema.primKeyName: Histogram(b_tree.keys(), size)}
+        for field_name in schema.indexedFields():
+            tree = bTrees[(schema.name, field_name)]
+            self.histograms[field_name] = Histogram((key[0] for key in tree.keys()), tree.size)
+        self.version: int = typeVersions[schema.name]
+
+    def selectivity(self, field_name, bounds):
+        """Estimated share of the records within bounds on field_name. Fields without a
+        histogram get the usual guesses of a tenth for = and a third for a range."""
+        low, high, includeLow, includeHigh = bounds
+        if low is not None and high is not None and (high < low or (low == high and not (includeLow and includeHigh))):
+            return 0.0
+        histogram = self.histograms.get(field_name)
+        if histogram is not None:
+            return histogram.fraction(low, high)
+        if low is not None and low == high:
+            return 0.1
+        if low is not None and high is not None:
+            return 0.25
+        return 1 / 3
+
+    def pageReads(self, rows):
+        """Estimated data pages read to fetch rows records through an index. readRecords reads
+        a page once per batch of SCAN_BATCH records, and Cardenas' formula gives the pages a
+        batch touches when its records are spread over the pages in use."""
+        if self.pagesInUse == 0 or rows <= 0:
+            return 0.0
+        batches, remainder = divmod(rows, SCAN_BATCH)
+        perBatch = lambda n: self.pagesInUse * (1 - (1 - 1 / self.pagesInUse) ** n)
+        return batches * perBatch(SCAN_BATCH) + perBatch(remainder)
+
+
+class FilterPlan(object):
+    """How filterRecord answers a list of conditions: an access path on one field, and the
+    conditions left to check on the records that the access path returns.
+    Attributes:
+        kind (str): "index point lookup", "index range scan" or "full scan"
+        field_name (str): field of the access path
+        bounds (tuple): (low, high, includeLow, includeHigh) of the access path
+        residual (list): (field_name, bounds) pairs checked on every record
+        rows (float): estimated number of matching records
+        pageReads (float): estimated pages read
+    """
+
+    def __init__(self, kind, field_name, bounds, residual, rows, pageReads):
+        self.kind: str = kind
+        self.field_name: str = field_name
+        self.bounds: tuple = bounds
+        self.residual: list = residual
+        self.rows: float = rows
+        self.pageReads: float = pageReads
+
+    def describe(self, type_name):
+        return "{} on {}.{} ({})".format(self.kind, type_name, self.field_name,
+                                         describeBounds(self.field_name, self.bounds))
+
 
 def demo():
     bplustree = BPlusTree()
@@ -390,24 +2024,11 @@ def demo():
 
 
 def checkFileEmpty(file_name):
-    
-    systemCat = open("systemCatalog.csv")
-
-    lines = systemCat.readlines()
-
-    text = ""
 
-    type_name = file_name[0:file_name.index("_")]
+    type_name = file_name[0:file_name.rindex("_")]
     print(type_name)
 
-    for line in lines:
-        if line[0: len(type_name)] == type_name:
-            text = line
-            break
-
-
-    nofFields = int(text.split(",")[1])
-    lengthOfARecord = int(nofFields * 20)
+    lengthOfARecord = catalog[type_name].lengthOfARecord
 
     f = open(file_name,"r")
     f.seek(1)
@@ -443,235 +2064,365 @@ def checkFileEmpty(file_name):
 
 
 
-def createType(type_name, nof_fields, prim_key_order, fieldsAndTypes):
+def createType(type_name, nof_fields, prim_key_order, fieldsAndTypes, options=None):
 
-    x = getAllTypeNames()
-
-    if type_name in x:
+    if type_name in catalog:
         return False
     #print("create typedayım")
-    bplustree = BPlusTree()
+    schema = TypeSchema(type_name, nof_fields, prim_key_order, fieldsAndTypes, [type_name+"_1.txt"], options)
 
-    bTrees[type_name] = bplustree
+    for field_name in schema.indexedFields():
+        if schema.fieldIndex(field_name) in (-1, prim_key_order-1):
+            return False
 
-    file = open("systemCatalog.csv", "a+")
-    f = open(type_name+"_1.txt", "a+")
-    btreefile = open("bTree" +type_name +".txt","a+")
-    #btreefile.write("{}")
+    try:
+        if not 1 <= schema.pagesInAFile() <= MAX_PAGES_IN_A_FILE:
+            return False
+        if schema.fanout() < MIN_BTREE_FANOUT:
+            return False
+    except ValueError:
+        return False
 
-    file.write(type_name+","+str(nof_fields)+","+str(prim_key_order)+","+str(fieldsAndTypes)+","+type_name+"_1.txt"+"\n")
+    if schema.options.get("format", "text") not in ("text", "binary"):
+        return False
 
-    nofFields = len(fieldsAndTypes)/2
-    lengthOfARecord = int(nofFields * 20)
-    #f.seek(0)
-    #print("noffields",nofFields)
-    #print("lengthofarecord",lengthOfARecord)
+    if schema.options.get("compress", "zlib") not in COMPRESSION_CODECS:
+        return False
 
-    nofRecords = math.floor((PAGESIZE-1) / (lengthOfARecord+1))
-    #print("nofrecords",nofRecords)
+    if os.path.exists(indexFileName(type_name)):
+        os.remove(indexFileName(type_name))
 
+    bTrees[type_name] = newIndex(schema)
+    for field_name in schema.indexedFields():
+        bTrees[(type_name, field_name)] = newSecondaryIndex(schema)
 
-    text = "0"+(" " * lengthOfARecord)
+    formatDataFile(type_name+"_1.txt", schema.lengthOfARecord, schema.pagesInAFile())
 
-    for page in range(PAGE_IN_A_FILE):
+    freeSpaceMaps[type_name] = FreeSpaceMap(schema.lengthOfARecord, schema.pagesInAFile())
+    freeSpaceMaps[type_name].addFile(type_name+"_1.txt")
 
-    
-        f.write("0")
-        for i in range(nofRecords):
-            f.write(text)
+    catalog.add(schema)
+    markModified(type_name)
 
-        f.write(" "*(PAGESIZE-len(text)*nofRecords - 1 ))
+    return True
 
-    file.close()
+def emptyPage(lengthOfARecord):
+    """An empty page: a page header, empty record slots and padding."""
+    nofRecords = math.floor((PAGESIZE-1) / (lengthOfARecord+1))
+
+    text = "0"+(" " * lengthOfARecord)
+    return "0" + text*nofRecords + " "*(PAGESIZE-len(text)*nofRecords - 1)
+
+def segmentImage(lengthOfARecord, nofPages):
+    """The bytes of an empty data file of nofPages pages, built once for each record length and size."""
+    image = segmentImages.get((lengthOfARecord, nofPages))
+    if image is None:
+        image = emptyPage(lengthOfARecord).encode() * nofPages
+        segmentImages[(lengthOfARecord, nofPages)] = image
+    return image
+
+def formatDataFile(fileName, lengthOfARecord, nofPages=PAGE_IN_A_FILE):
+    """Writes nofPages empty pages with a single write of the prebuilt image."""
+    f = open(fileName, "wb")
+    f.write(segmentImage(lengthOfARecord, nofPages))
     f.close()
 
-    return True
+def addSegment(schema):
+    """Formats the next data file of a type and registers it with the catalog and the free-space map."""
+    fileName = schema.dataFile(max(schema.fileNo(name) for name in schema.files) + 1)
+    formatDataFile(fileName, schema.lengthOfARecord, schema.pagesInAFile())
+    freeSpaceMaps[schema.name].addFile(fileName)
+    schema.files.append(fileName)
+    catalog.save()
+    return fileName
 
 
 
 def createRecord(type_name, fields):
 
-    types = getAllTypeNames()
-
-    if type_name not in types:
+    if type_name not in catalog:
         return False
 
+    schema = catalog[type_name]
 
-    systemCat = open("systemCatalog.csv")
-
-    lines = systemCat.readlines()
-
-    text = ""
-
-    for line in lines:
-        if line[0: len(type_name)] == type_name:
-            text = line
-            break
-
-    #print(text,end="")
-    fileName = text.split(',')[-1][:-1]
-
-    #print(fileName,end="")
-
-    f = open(fileName, "r+")
-    byte= 0
-    f.seek(byte)
-    processedPage = 0
-    isFull = False
-    pageNo = 0
-
-    nofFields = int(text.split(",")[1])
-    prim_key_order = int(text.split(",")[2])
-    lengthOfARecord = int(nofFields * 20)
-    recordsInAPage = int(math.floor((PAGESIZE-1)/(lengthOfARecord+1)))
-
-    primkey = fields[int(prim_key_order)-1]
-    
+    if len(fields) != schema.nofFields:
+        return False
 
-    if len(fields) != nofFields:
+    try:
+        primkey = encodeKey(schema.primKeyType, fields[schema.primKeyOrder-1])
+    except ValueError:
         return False
 
-    
-    
     b_tree = bTrees[type_name]
-    
-    leftMost = b_tree.leftmost_leaf()
-    keys = []
+    leaf = b_tree.find(primkey)
 
-    while leftMost is not None:
-        keys.extend(leftMost.keys) 
-        leftMost =  leftMost.next 
-    
-    if primkey in keys:
+    if leaf.position(primkey) >= 0:
         return False
-   
-    updfields = ""
-    for fd in fields:
-        a = '{:20}'.format(fd)
-        updfields = updfields + a
-    
 
-    while f.read(1) != "0":
-        #print("page no", pageNo)
-        if pageNo == PAGE_IN_A_FILE-1:
-            isFull = True
-            print("doldu")
-            break
-        byte = byte + PAGESIZE
-        f.seek(byte)
-        #print("byte nosunda bunu okuyo,",byte,":",f.read(1))
-        pageNo = pageNo + 1
-        #print("byte",byte)
-    recordNo = 0
-    if isFull == False:
-        f.seek(byte+1)
-        recordLocation = byte + 1
-        while f.read(1) != "0":
-            
-            recordLocation = recordLocation + lengthOfARecord + 1
-            #print("record loc",recordLocation)
-            f.seek(recordLocation)
-            recordNo = recordNo + 1
-            #print("recordno: ",recordNo)
-        f.seek(recordLocation)
-        f.write("1")
-        f.seek(recordLocation + 1)
-        f.write(updfields)
-        address = fileName + "," + str(recordLocation+1)
-        #print("address:",address)
-        #print("records in a page",recordsInAPage)
-        if recordNo == recordsInAPage-1:
-            f.seek(byte)
-            f.write("1")
-    else:
-        f.close()
-        fileno = int(re.findall("_[\d]*.txt", str(fileName))[0].split('.')[0])+1
-        #print(fileno)
-        newfilename = type_name + "_"+ str(fileno) +".txt"
-        #print("newfilename: ",newfilename)
-        newFile = open(newfilename,"w+")
-        
-        nofFields = len(fields)
-        lengthOfARecord = int(nofFields * 20)
-        recordsInAPage = int(math.floor((PAGESIZE-1)/(lengthOfARecord+1)))
+    if not schema.recordFormat.fits(fields):
+        return False
 
-        nofRecords = math.floor((PAGESIZE-1) / (lengthOfARecord+1))
+    fsm = freeSpaceMaps[type_name]
+    location = fsm.allocate()
 
+    if location is None:
+        # every page of every file is full, continue in a new file
+        addSegment(schema)
+        location = fsm.allocate()
 
-        text = "0"+(" " * lengthOfARecord)
+    fileName, pageNo, slot = location
+    address = packAddress(schema.fileNo(fileName), pageNo, slot)
+    writeAheadLog.append("create", type_name, address, fields)
 
-        for page in range(PAGE_IN_A_FILE):
+    page = bufferPool.pin(fileName, pageNo)
+    start = schema.recordOffset(slot)
+    page[start] = ord("1")
+    schema.recordFormat.pack_into(page, start+1, fields)
+    if fsm.isFull(fileName, pageNo):
+        page[0:1] = b"1"
+    bufferPool.unpin(fileName, pageNo, True)
 
-        
-            newFile.write("0")
-            for i in range(nofRecords):
-                newFile.write(text)
+    b_tree.insert(primkey, address, leaf)
+    markModified(type_name)
+    indexRecord(schema, fields, address)
 
-            newFile.write(" "*(PAGESIZE-len(text)*nofRecords - 1 ))
-        
-      
-        newFile.seek(1)
-        newFile.write("1")
-        newFile.seek(2)
-        newFile.write(updfields)
-        systemCat.close()
+    return True
 
-        address = fileName + "," + str(2)
+def loadRecords(type_name, csvFileName, fillFactor=BULK_FILL_FACTOR):
+    """Bulk loads the rows of a csv file into an existing type. The rows are sorted by primary
+    key and written page after page into new data files, then the B+ tree is rebuilt bottom-up.
+    Rows with a wrong number of fields, a bad key or a key that is already used are skipped.
+    Empty cells are only accepted by format=binary types, which store them as null fields.
+    """
+    if type_name not in catalog or not os.path.exists(csvFileName):
+        return False
+    if not 0 < fillFactor <= 1:
+        return False
 
-        with open('systemCatalog.csv', 'r') as cat :
-            filedata = cat.read()
+    schema = catalog[type_name]
+    recordFormat = schema.recordFormat
+    nullable = isinstance(recordFormat, BinaryRecordFormat)
+    b_tree = bTrees[type_name]
 
-        # Replace the target string
-        filedata = filedata.replace(fileName, newfilename)
+    rows = []
+    csvFile = open(csvFileName, newline="")
+    for row in csv.reader(csvFile):
+        row = [field.strip() for field in row]
+        if len(row) != schema.nofFields or not recordFormat.fits(row):
+            continue
+        if any(len(field.split()) != 1 and not (nullable and field == "") for field in row):
+            continue
+        if row[schema.primKeyOrder-1] == "":
+            continue
+        if nullable:
+            row = [field if field != "" else None for field in row]
+        try:
+            rows.append((encodeKey(schema.primKeyType, row[schema.primKeyOrder-1]), row))
+        except ValueError:
+            continue
+    csvFile.close()
+
+    rows.sort(key=lambda keyAndRow: keyAndRow[0])
+
+    unique = []
+    for key, row in rows:
+        if (len(unique) == 0 or unique[-1][0] != key) and key not in b_tree:
+            unique.append((key, row))
+
+    fsm = freeSpaceMaps[type_name]
+    pagesInAFile = schema.pagesInAFile()
+    recordsInAFile = schema.recordsInAPage * pagesInAFile
+    fileno = max(schema.fileNo(fileName) for fileName in schema.files)
+    items = []
+    secondaryItems = {}
+
+    for first in range(0, len(unique), recordsInAFile):
+        fileno = fileno + 1
+        fileName = schema.dataFile(fileno)
+        image = bytearray(segmentImage(schema.lengthOfARecord, pagesInAFile))
+        bitmaps = [0] * pagesInAFile
+
+        for i, (key, row) in enumerate(unique[first:first+recordsInAFile]):
+            pageNo = i // schema.recordsInAPage
+            slot = i % schema.recordsInAPage
+            recordLocation = fsm.recordLocation(pageNo, slot)
+            image[recordLocation] = ord("1")
+            recordFormat.pack_into(image, recordLocation+1, row)
+            bitmaps[pageNo] |= 1 << slot
+            if slot == schema.recordsInAPage - 1:
+                image[pageNo*PAGESIZE] = ord("1")
+            items.append((key, packAddress(fileno, pageNo, slot)))
+            for field_name in schema.indexedFields():
+                secondary = secondaryKey(schema, field_name, row, items[-1][1])
+                if secondary is not None:
+                    secondaryItems.setdefault(field_name, []).append((secondary, items[-1][1]))
+
+        f = open(fileName, "wb")
+        f.write(image)
+        f.flush()
+        # the rows are not logged one by one, the new file is synced instead
+        os.fsync(f.fileno())
+        f.close()
 
+        fsm.addFile(fileName, bitmaps)
+        schema.files.append(fileName)
 
-        # Write the file out again
-        with open('systemCatalog.csv', 'w') as ctlg:
-            ctlg.write(filedata)
+    # the load is synced to the log before the catalog lists the new files, so a run that
+    # dies after this point rebuilds the indexes of the type from its files on the next start
+    writeAheadLog.append("load", type_name)
+    writeAheadLog.commit()
+    catalog.save()
 
-    
-    b_tree = bTrees[type_name]
+    merged = heapq.merge(b_tree.scan(), items, key=lambda item: item[0])
+    b_tree.bulkLoad(list(merged), fillFactor)
+    markModified(type_name)
+    # a load changes the version once however many rows it adds, so the statistics go now
+    typeStatistics.pop(type_name, None)
 
-    primkey = fields[int(prim_key_order)-1]
+    for field_name, new in secondaryItems.items():
+        tree = bTrees[(type_name, field_name)]
+        new.sort()
+        tree.bulkLoad(list(heapq.merge(tree.scan(), new)), fillFactor)
 
-    b_tree[primkey] = address
+    return True
+
+def compactType(type_name, outputFile):
+    """Moves the records of a type, in address order, to the first slots of its first data
+    files, so that they fill as few pages and files as possible, then deletes the files that
+    are left empty. A record never moves past its old address, so the records can be moved in
+    place. Every move is logged, and the indexes are rebuilt with the new addresses in the
+    same pass. Writes the bytes reclaimed and the number of files kept.
+    """
+    if type_name not in catalog:
+        return False
 
+    schema = catalog[type_name]
+    recordFormat = schema.recordFormat
+    indexedFields = schema.indexedFields()
+    files = sorted(schema.files, key=schema.fileNo)
+    pagesInAFile = schema.pagesInAFile()
+    recordsInAFile = schema.recordsInAPage * pagesInAFile
+
+    entries = sorted(bTrees[type_name].scan(), key=lambda entry: entry[1])
+    items = []
+    secondaryItems = {field_name: [] for field_name in indexedFields}
+
+    for i, (key, address) in enumerate(entries):
+        target = packAddress(schema.fileNo(files[i // recordsInAFile]), i % recordsInAFile // schema.recordsInAPage,
+                             i % schema.recordsInAPage)
+        if target != address or indexedFields:
+            fileNo, pageNo, slot = unpackAddress(address)
+            page = bufferPool.pin(schema.dataFile(fileNo), pageNo)
+            start = schema.recordOffset(slot)
+            record = bytes(page[start+1:start+1+schema.lengthOfARecord])
+            fields = recordFormat.unpack(record)
+
+            if target != address:
+                targetNo, targetPage, targetSlot = unpackAddress(target)
+                writeAheadLog.append("create", type_name, target, fields)
+                writeAheadLog.append("delete", type_name, address)
+                moved = bufferPool.pin(schema.dataFile(targetNo), targetPage)
+                targetStart = schema.recordOffset(targetSlot)
+                moved[targetStart] = ord("1")
+                moved[targetStart+1:targetStart+1+schema.lengthOfARecord] = record
+                bufferPool.unpin(schema.dataFile(targetNo), targetPage, True)
+                page[start] = ord("0")
+            bufferPool.unpin(schema.dataFile(fileNo), pageNo, target != address)
+
+            for field_name in indexedFields:
+                secondary = secondaryKey(schema, field_name, fields, target)
+                if secondary is not None:
+                    secondaryItems[field_name].append((secondary, target))
+        items.append((key, target))
+
+    # the records now fill the first slots, every page after them is empty
+    nofFiles = max(1, -(-len(entries) // recordsInAFile))
+    fsm = FreeSpaceMap(schema.lengthOfARecord, pagesInAFile)
+    for j, fileName in enumerate(files[:nofFiles]):
+        bitmaps = []
+        for pageNo in range(pagesInAFile):
+            used = min(schema.recordsInAPage, max(0, len(entries) - j*recordsInAFile - pageNo*schema.recordsInAPage))
+            bitmaps.append((1 << used) - 1)
+            page = bufferPool.pin(fileName, pageNo)
+            page[0] = ord("1") if used == schema.recordsInAPage else ord("0")
+            bufferPool.unpin(fileName, pageNo, True)
+        fsm.addFile(fileName, bitmaps)
+    freeSpaceMaps[type_name] = fsm
+
+    items.sort()
+    bTrees[type_name].bulkLoad(items, BULK_FILL_FACTOR)
+    for field_name in indexedFields:
+        secondaryItems[field_name].sort()
+        bTrees[(type_name, field_name)].bulkLoad(secondaryItems[field_name], BULK_FILL_FACTOR)
+    markModified(type_name)
+    typeStatistics.pop(type_name, None)
+
+    removed = files[nofFiles:]
+    schema.files = files[:nofFiles]
+    catalog.save()
+
+    # the files are only deleted once nothing in the log can refer to them
+    checkpoint()
+    reclaimed = 0
+    for fileName in removed:
+        bufferPool.dropFile(fileName)
+        if os.path.exists(fileName):
+            reclaimed += os.path.getsize(fileName)
+            os.remove(fileName)
+
+    outputFile.write("{} bytes reclaimed, {} of {} data files kept\n".format(reclaimed, nofFiles, len(files)))
     return True
 
 def deleteType(type_name):
 
-    types = getAllTypeNames()
-
-    if type_name not in types:
+    if type_name not in catalog:
         return False
-    
-    del bTrees[type_name]
 
-    dir_name = "./"
-    test = os.listdir(dir_name)
-    print(test)
+    schema = catalog[type_name]
+    secondaries = [secondaryName(type_name, field_name) for field_name in schema.indexedFields()]
+    files = schema.files + [snapshotName(type_name), indexFileName(type_name), "bTree" + type_name + ".txt",
+                            "freeSpace" + type_name + ".txt"] + secondaries
+
+    # the changes logged for the type are void once its files are gone. The drop is logged
+    # with the files it removes and the type leaves the catalog before any of them, so that
+    # replayLog can finish a drop the run did not
+    writeAheadLog.append("drop", type_name, 0, files)
+    writeAheadLog.commit()
+    catalog.remove(type_name)
+
+    bTrees.drop(type_name)
+    freeSpaceMaps.pop(type_name, None)
+    typeStatistics.pop(type_name, None)
+
+    for item in files:
+        bufferPool.dropFile(item)
+        if os.path.exists(item):
+            os.remove(item)
+    modifiedTypes.discard(type_name)
+    typeVersions[type_name] += 1
 
-    for item in test:
-        if item.startswith(type_name):
-            os.remove(os.path.join(dir_name, item))
-    btr="bTree" + type_name + ".txt"
-    os.remove(btr)
-
-    
+    return True
 
-    with open("systemCatalog.csv", "r") as f:
-        lines = f.readlines()
-    with open("systemCatalog.csv", "w") as f:
-        for line in lines:
-            if line.split(",")[0] != type_name:
-                f.write(line)
+def listSegments(type_name, outputFile):
+    """Writes each data file of a type with its used and total record slots, and the size of the
+    compressed ones."""
+    if type_name not in catalog:
+        return False
 
+    for fileName, used, slots in freeSpaceMaps[type_name].segments():
+        dataFile = bufferPool.file(fileName)
+        if isinstance(dataFile, CompressedDataFile) and dataFile.plain is None:
+            # compressed files also give their size on disk against their plain size
+            outputFile.write("{} {}/{} {} {}/{} bytes\n".format(fileName, used, slots, dataFile.codecName,
+                                                              os.path.getsize(fileName), dataFile.nofPages()*PAGESIZE))
+        else:
+            outputFile.write("{} {}/{}\n".format(fileName, used, slots))
 
     return True
 
 def listType(outputFile):
     
-    types = getAllTypeNames()
+    types = catalog.names()
 
     for type in types:
         outputFile.write(type+"\n")
@@ -688,356 +2439,1120 @@ def deleteRecord(type_name, prim_key):
 
     
 
-    types = getAllTypeNames()
+    if type_name not in catalog:
+        return False
 
-    if type_name not in types:
+    try:
+        prim_key = encodeKey(catalog[type_name].primKeyType, prim_key)
+    except ValueError:
         return False
     
     b_tree = bTrees[type_name]
-    
-    leftMost = b_tree.leftmost_leaf()
-    keys = []
+    leaf = b_tree.find(prim_key)
+    address = leaf.getAddress(prim_key)
 
-    while leftMost is not None:
-        keys.extend(leftMost.keys) 
-        leftMost =  leftMost.next 
-    
-    if prim_key not in keys:
+    if address is None:
         return False
-    
-    
-
-    address = bTrees[type_name].find(prim_key).getAddress(prim_key)
    
-    file = address.split(',')[0]
-    byte = int(address.split(',')[1])
-    f = open(file,"r+")
-    f.seek(byte-1)
-    f.write("0")
-    page_start = byte - (byte % PAGESIZE)
-    f.seek(page_start)
-    f.write("0")
+    schema = catalog[type_name]
+    fileNo, pageNo, slot = unpackAddress(address)
+    file = schema.dataFile(fileNo)
+    writeAheadLog.append("delete", type_name, address)
+
+    page = bufferPool.pin(file, pageNo)
+    if schema.indexedFields():
+        fields = schema.recordFormat.unpack(schema.recordFormat.view(page, schema.recordOffset(slot)+1))
+    page[schema.recordOffset(slot)] = ord("0")
+    page[0] = ord("0")
+    bufferPool.unpin(file, pageNo, True)
 
-    btr = bTrees[type_name].delete(prim_key)
+    freeSpaceMaps[type_name].release(file, pageNo, slot)
+
+    b_tree.delete(prim_key, leaf)
+    markModified(type_name)
+    if schema.indexedFields():
+        unindexRecord(schema, fields, address)
 
     return True
 
 def updateRecord(type_name, prim_key, fields):
 
-    types = getAllTypeNames()
+    if type_name not in catalog:
+        return False
 
-    if type_name not in types:
+    try:
+        prim_key = encodeKey(catalog[type_name].primKeyType, prim_key)
+    except ValueError:
         return False
     
-    b_tree = bTrees[type_name]
-    
-    leftMost = b_tree.leftmost_leaf()
-    keys = []
+    address = bTrees[type_name].query(prim_key)
 
-    while leftMost is not None:
-        keys.extend(leftMost.keys) 
-        leftMost =  leftMost.next 
-    
-    if prim_key not in keys:
+    if address is None:
         return False
 
-    address = bTrees[type_name].find(prim_key).getAddress(prim_key)
+    schema = catalog[type_name]
 
-    updfields =""
-    for fd in fields:
-        a = '{:20}'.format(fd)
-        updfields = updfields + a
-    
-    file = address.split(',')[0]
-    byte = int(address.split(',')[1])
-    f = open(file,"r+")
-    f.seek(byte)
-    f.write(updfields)
-    
-    
+    if not schema.recordFormat.fits(fields):
+        return False
 
+    fileNo, pageNo, slot = unpackAddress(address)
+    file = schema.dataFile(fileNo)
+    writeAheadLog.append("update", type_name, address, fields)
+
+    page = bufferPool.pin(file, pageNo)
+    if schema.indexedFields():
+        oldFields = schema.recordFormat.unpack(schema.recordFormat.view(page, schema.recordOffset(slot)+1))
+    schema.recordFormat.pack_into(page, schema.recordOffset(slot)+1, fields)
+    bufferPool.unpin(file, pageNo, True)
+
+    if schema.indexedFields():
+        markModified(type_name)
+        unindexRecord(schema, oldFields, address)
+        indexRecord(schema, fields + oldFields[len(fields):], address)
+    else:
+        # the index is unchanged, but results cached for the old record are not
+        typeVersions[type_name] += 1
 
     return True
 
 def searchRecord(type_name, prim_key):
 
-    types = getAllTypeNames()
+    if type_name not in catalog:
+        return None,False
 
-    if type_name not in types:
+    try:
+        prim_key = encodeKey(catalog[type_name].primKeyType, prim_key)
+    except ValueError:
         return None,False
     
-    b_tree = bTrees[type_name]
-    
-    leftMost = b_tree.leftmost_leaf()
-    keys = []
+    address = bTrees[type_name].query(prim_key)
 
-    while leftMost is not None:
-        keys.extend(leftMost.keys) 
-        leftMost =  leftMost.next 
-    
-    if prim_key not in keys:
+    if address is None:
         return None,False
 
-    systemCat = open("systemCatalog.csv")
-
-    lines = systemCat.readlines()
+    return readRecord(catalog[type_name], address), True
 
-    text = ""
+def searchRecords(type_name, prim_keys):
+    """Looks up many primary keys at once. The keys are resolved through the B+ tree in key
+    order, then all the records are read as one readRecords batch, so the data files are
+    swept in address order and every page is read once.
+    Returns:
+        (list,bool): the record of each key in the order given, None for a key that is not
+        found, and whether every key was found
+    """
+    if type_name not in catalog:
+        return [None] * len(prim_keys), False
 
-    for line in lines:
-        if line[0: len(type_name)] == type_name:
-            text = line
-            break
+    schema = catalog[type_name]
+    b_tree = bTrees[type_name]
 
-    nofFields = int(text.split(",")[1])
-    
-    address = bTrees[type_name].find(prim_key).getAddress(prim_key)
-    #print("address search ",address)
-    file = address.split(',')[0]
-    byte = int(address.split(',')[1])
-    f = open(file,"r")
-    f.seek(byte)
-    #print("nof fields", nofFields)
-    fields = f.read(20*nofFields).split()
-    tofile = " ".join(fields)
-    return tofile, True
- 
+    keys = {}
+    for prim_key in prim_keys:
+        try:
+            keys[prim_key] = encodeKey(schema.primKeyType, prim_key)
+        except ValueError:
+            pass
+
+    addresses = {}
+    for key in sorted(set(keys.values())):
+        address = b_tree.query(key)
+        if address is not None:
+            addresses[key] = address
+
+    entries = list(addresses.items())
+    records = dict(zip(addresses, readRecords(schema, entries, max(1, len(entries)))))
+
+    results = [records.get(keys.get(prim_key)) for prim_key in prim_keys]
+    return results, None not in results
+
+def readRecord(schema, address):
+    """Reads the record at address and joins its fields with spaces."""
+    fileNo, pageNo, slot = unpackAddress(address)
+    file = schema.dataFile(fileNo)
+
+    page = bufferPool.pin(file, pageNo)
+    record = schema.recordFormat.view(page, schema.recordOffset(slot)+1)
+    fields = schema.recordFormat.unpack(record)
+    record.release()
+    bufferPool.unpin(file, pageNo)
+    return schema.recordFormat.joinFields(fields)
+
+def readRecords(schema, entries, batchSize=SCAN_BATCH, decode=None):
+    """Yields the records of (key, address) pairs joined with spaces, in the order of the pairs.
+    The pairs are read a batch at a time. A packed address sorts by file, page and slot, so
+    sorting a batch groups its records by page and every page is pinned once per batch.
+    decode(page, offset) replaces the joined record by what it returns for the record header at offset.
+    """
+    recordFormat = schema.recordFormat
+    entries = iter(entries)
 
-def listRecord(type_name, outputFile):
+    while True:
+        batch = [address for key, address in itertools.islice(entries, batchSize)]
+        if not batch:
+            return
 
-    types = getAllTypeNames()
+        records = {}
+        page = None
+        pageAddress = -1
+        file = None
+        prevPageNo = -1
+        for address in sorted(batch):
+            fileNo, pageNo, slot = unpackAddress(address)
+            if address >> 16 != pageAddress:
+                if page is not None:
+                    bufferPool.unpin(file, prevPageNo)
+                file = schema.dataFile(fileNo)
+                page = bufferPool.pin(file, pageNo)
+                pageAddress = address >> 16
+                prevPageNo = pageNo
+            if decode is not None:
+                records[address] = decode(page, schema.recordOffset(slot))
+                continue
+            record = recordFormat.view(page, schema.recordOffset(slot)+1)
+            records[address] = recordFormat.joinFields(recordFormat.unpack(record))
+            record.release()
+        bufferPool.unpin(file, prevPageNo)
+
+        for address in batch:
+            yield records[address]
+ 
 
-    if type_name not in types:
+def inBounds(value, low, high, includeLow, includeHigh):
+    if low is not None and (value < low or (value == low and not includeLow)):
         return False
+    if high is not None and (high < value or (value == high and not includeHigh)):
+        return False
+    return True
 
-    b_tree = bTrees[type_name]
-    
-    leftMost = b_tree.leftmost_leaf()
-    keys = []
+def scanRecords(schema, field_name, low, high, includeLow, includeHigh):
+    """Full scan for a filter on a field without an index. The data files are read straight
+    from their mappings, so a scan does not push the working set out of the buffer pool.
+    Returns:
+        list: the fields of the matching records, in primary key order
+    """
+    fieldNo = schema.fieldIndex(field_name)
+    fieldType = schema.fieldType(field_name)
+    dataFiles = []
+    for fileName in schema.files:
+        bufferPool.writeBackFile(fileName)
+        dataFiles.append(bufferPool.file(fileName))
+
+    if numpy is not None:
+        slots = matchSlotsVectorized(schema, dataFiles, fieldNo, fieldType, low, high, includeLow, includeHigh)
+    else:
+        slots = matchSlots(schema, dataFiles, fieldNo, fieldType, low, high, includeLow, includeHigh)
+
+    matches = []
+    for dataFile, pageNo, slot in slots:
+        matches.append(schema.recordFormat.unpack(dataFile.view[pageNo*PAGESIZE + schema.recordOffset(slot) + 1:]))
+    for dataFile in dataFiles:
+        dataFile.release()
+
+    matches.sort(key=lambda fields: encodeKey(schema.primKeyType, fields[schema.primKeyOrder-1]))
+    return matches
+
+def matchSlots(schema, dataFiles, fieldNo, fieldType, low, high, includeLow, includeHigh):
+    """Yields the data file, page number and slot of the used records whose field fieldNo is
+    within the bounds. Only that field of each record is decoded."""
+    recordFormat = schema.recordFormat
+
+    for dataFile in dataFiles:
+        view = dataFile.view
+        for pageNo in range(dataFile.nofPages()):
+            for slot in range(schema.recordsInAPage):
+                start = pageNo*PAGESIZE + schema.recordOffset(slot)
+                if view[start] != ord("1"):
+                    continue
+                try:
+                    value = encodeKey(fieldType, recordFormat.decodeField(view, start+1, fieldNo))
+                except ValueError:
+                    continue
+                if inBounds(value, low, high, includeLow, includeHigh):
+                    yield dataFile, pageNo, slot
+
+def matchSlotsVectorized(schema, dataFiles, fieldNo, fieldType, low, high, includeLow, includeHigh):
+    """matchSlots with numpy. The pages of each file are viewed as a (pages, slots, slot bytes)
+    array and the record headers give the mask of used slots. The column of the filtered field
+    is gathered from every file and the predicate is evaluated on all of it at once.
+    """
+    slotLength = schema.lengthOfARecord + 1
+    binary = isinstance(schema.recordFormat, BinaryRecordFormat)
+    if binary:
+        fieldStart = 1 + schema.recordFormat.offsets[fieldNo]
+        fieldEnd = fieldStart + schema.recordFormat.codes[fieldNo].size
+    else:
+        fieldStart = 1 + fieldNo*FIELD_LENGTH
+        fieldEnd = fieldStart + FIELD_LENGTH
+    columns = []
+    nulls = []
+    fileNos = []
+    pageNos = []
+    slotNos = []
+
+    for fileNo, dataFile in enumerate(dataFiles):
+        nofPages = dataFile.nofPages()
+        pages = numpy.frombuffer(dataFile.map, numpy.uint8, nofPages*PAGESIZE).reshape(nofPages, PAGESIZE)
+        slots = pages[:, 1:1 + schema.recordsInAPage*slotLength].reshape(nofPages, schema.recordsInAPage, slotLength)
+        used = numpy.nonzero(slots[:, :, 0] == ord("1"))
+        columns.append(slots[used[0], used[1], fieldStart:fieldEnd])
+        if binary:
+            nulls.append(slots[used[0], used[1], 1 + fieldNo // 8] & (1 << fieldNo % 8) != 0)
+        fileNos.append(numpy.full(len(used[0]), fileNo))
+        pageNos.append(used[0])
+        slotNos.append(used[1])
+        del pages, slots
+
+    if not columns:
+        return []
+    column = numpy.concatenate(columns)
+
+    if binary:
+        # the fields are fixed width already, null fields never match
+        if fieldType == "int":
+            values = column.view("<i8").ravel()
+        else:
+            values = column[:, 1:].copy().view("S%d" % FIELD_LENGTH).ravel()
+            low = low.encode() if low is not None else None
+            high = high.encode() if high is not None else None
+        exact = ~numpy.concatenate(nulls)
+        column = None
+    elif fieldType == "int":
+        values, exact = parseIntColumn(column)
+    else:
+        # trailing spaces become NULs, which numpy ignores when it compares byte strings
+        values = numpy.where(column == ord(" "), 0, column).astype(numpy.uint8).view("S%d" % FIELD_LENGTH).ravel()
+        exact = numpy.ones(len(values), dtype=bool)
+        low = low.encode() if low is not None else None
+        high = high.encode() if high is not None else None
+
+    mask = exact
+    if low is not None:
+        mask = mask & ((values >= low) if includeLow else (values > low))
+    if high is not None:
+        mask = mask & ((values <= high) if includeHigh else (values < high))
+
+    # the values parseIntColumn left out are checked one by one, the same way as matchSlots
+    for i in numpy.nonzero(~exact)[0] if column is not None else ():
+        try:
+            value = encodeKey(fieldType, bytes(column[i]).decode().strip())
+        except ValueError:
+            continue
+        mask[i] = inBounds(value, low, high, includeLow, includeHigh)
 
-    while leftMost is not None:
-        keys.extend(leftMost.keys) 
-        leftMost =  leftMost.next   
+    return [(dataFiles[fileNo], pageNo, slot) for fileNo, pageNo, slot in
+            zip(numpy.concatenate(fileNos)[mask].tolist(), numpy.concatenate(pageNos)[mask].tolist(),
+                numpy.concatenate(slotNos)[mask].tolist())]
 
-    keys.sort
+def parseIntColumn(column):
+    """Parses a (records, FIELD_LENGTH) array of left aligned decimal text.
+    Returns:
+        (array,array): the values, and the mask of the rows in the plain form of an optional
+        minus, 1 to 18 digits and spaces. The other rows are left for int() to parse.
+    """
+    isDigit = (column >= ord("0")) & (column <= ord("9"))
+    isSpace = column == ord(" ")
+    negative = column[:, 0] == ord("-")
 
-    if len(keys)==0:
-        return False 
-    
-    for key in keys:
-        result,success = searchRecord(type_name,key)
-        outputFile.write(result+"\n")
-    
-    
+    signOrDigit = isDigit.copy()
+    signOrDigit[:, 0] |= negative
+    afterSpace = numpy.logical_or.accumulate(isSpace, axis=1)
+    nofDigits = isDigit.sum(axis=1)
+    exact = ((signOrDigit & ~afterSpace) | isSpace).all(axis=1) & (nofDigits > 0) & (nofDigits <= 18)
 
-    return True
+    # numpy parses byte strings itself, but fails on the whole array if one of them is not a number
+    values = numpy.zeros(len(column), dtype=numpy.int64)
+    values[exact] = column[exact].view("S%d" % FIELD_LENGTH).ravel().astype(numpy.int64)
 
-def filterRecord(type_name, condition, outputFile):
+    return values, exact
 
-    types = getAllTypeNames()
+def listRecord(type_name, outputFile):
 
-    if type_name not in types:
+    if type_name not in catalog:
         return False
-    
-    
-
 
     b_tree = bTrees[type_name]
-    
-    leftMost = b_tree.leftmost_leaf()
-    keys = []
 
-    while leftMost is not None:
-        keys.extend(leftMost.keys) 
-        leftMost =  leftMost.next   
+    if b_tree.empty():
+        return False 
 
-    i = 0
-    for key in keys:
-        if key.isnumeric():
-            keys[i] = int(key)
-        i = i+1
+    # one pass along the leaf chain, in primary key order
+    for record in readRecords(catalog[type_name], b_tree.scan()):
+        outputFile.write(record+"\n")
 
-    keys.sort()
-    systemCat = open("systemCatalog.csv")
+    return True
 
-    lines = systemCat.readlines()
+def conditionBounds(condition, field_name):
+    """Turns a condition such as id>5, 5>id or id=5 into key bounds.
+    Returns:
+        (str,str,bool,bool): low, high and whether each bound is inclusive. None if the condition is not on field_name
+    """
+    for operator in (">", "<", "="):
+        if operator in condition:
+            left, right = condition.split(operator, 1)
+            left = left.strip()
+            right = right.strip()
+            break
+    else:
+        return None
+
+    if left == field_name:
+        value = right
+        fieldOnLeft = True
+    elif right == field_name:
+        value = left
+        fieldOnLeft = False
+    else:
+        return None
+
+    if operator == "=":
+        return value, value, True, True
+    if (operator == ">") == fieldOnLeft:  # id>5 or 5<id
+        return value, None, False, True
+    return None, value, True, False     # id<5 or 5>id
+
+def intersectBounds(bounds, other):
+    """The bounds that satisfy both bounds, for two conditions on the same field."""
+    low, high, includeLow, includeHigh = bounds
+    if other[0] is not None and (low is None or other[0] > low or (other[0] == low and not other[2])):
+        low, includeLow = other[0], other[2]
+    if other[1] is not None and (high is None or other[1] < high or (other[1] == high and not other[3])):
+        high, includeHigh = other[1], other[3]
+    return low, high, includeLow, includeHigh
+
+def describeBounds(field_name, bounds):
+    low, high, includeLow, includeHigh = bounds
+    if low is not None and low == high and includeLow and includeHigh:
+        return "{}={}".format(field_name, low)
+    parts = []
+    if low is not None:
+        parts.append("{}{}{}".format(field_name, ">=" if includeLow else ">", low))
+    if high is not None:
+        parts.append("{}{}{}".format(field_name, "<=" if includeHigh else "<", high))
+    return " and ".join(parts)
+
+def parseConditions(schema, conditions):
+    """Turns condition words such as id>5 hp<10 into the bounds on each field, with the
+    conditions on the same field combined.
+    Returns:
+        dict: field name -> (low, high, includeLow, includeHigh). None if a condition is not on a field of the type
+    """
+    fields = {}
+    for condition in conditions:
+        for field_name in schema.fieldNames:
+            bounds = conditionBounds(condition, field_name)
+            if bounds is not None:
+                break
+        else:
+            return None
+
+        low, high, includeLow, includeHigh = bounds
+        try:
+            low = encodeKey(schema.fieldType(field_name), low) if low is not None else None
+            high = encodeKey(schema.fieldType(field_name), high) if high is not None else None
+        except ValueError:
+            return None
+
+        bounds = (low, high, includeLow, includeHigh)
+        fields[field_name] = intersectBounds(fields[field_name], bounds) if field_name in fields else bounds
+    return fields
+
+def statistics(schema):
+    """The planner statistics of a type, gathered again once a STATISTICS_REFRESH share of
+    the type has changed or a new index has no histogram yet."""
+    stats = typeStatistics.get(schema.name)
+    if (stats is None or typeVersions[schema.name] - stats.version > max(100, stats.nofRecords * STATISTICS_REFRESH)
+            or any(field_name not in stats.histograms for field_name in schema.indexedFields())):
+        stats = TypeStatistics(schema)
+        typeStatistics[schema.name] = stats
+    return stats
+
+def planFilter(schema, fields):
+    """Chooses the access path with the fewest estimated page reads for the bounds of parseConditions.
+    Returns:
+        list: the candidate FilterPlans, the chosen one first
+    """
+    stats = statistics(schema)
+
+    rows = stats.nofRecords
+    for field_name, bounds in fields.items():
+        rows = rows * stats.selectivity(field_name, bounds)
+
+    candidates = []
+    for field_name, bounds in fields.items():
+        residual = [(other, fields[other]) for other in fields if other != field_name]
+        fetched = stats.nofRecords * stats.selectivity(field_name, bounds)
+
+        if field_name == schema.primKeyName:
+            low, high, includeLow, includeHigh = bounds
+            point = low is not None and low == high and includeLow and includeHigh
+            indexReads = 0
+            if stats.paged:
+                # the paged index reads a page per level, then the leaves of the range
+                indexReads = stats.depth + 1 + fetched / bTrees[schema.name].leafCapacity
+            candidates.append(FilterPlan("index point lookup" if point else "index range scan", field_name, bounds,
+                                         residual, rows, indexReads + stats.pageReads(fetched)))
+        elif field_name in schema.indexedFields():
+            candidates.append(FilterPlan("index range scan", field_name, bounds, residual, rows, stats.pageReads(fetched)))
+
+    # a full scan reads every page, and checks the most selective condition first
+    scanField = min(fields, key=lambda field_name: stats.selectivity(field_name, fields[field_name]))
+    candidates.append(FilterPlan("full scan", scanField, fields[scanField],
+                                 [(other, fields[other]) for other in fields if other != scanField], rows, stats.nofPages))
+
+    candidates.sort(key=lambda plan: plan.pageReads)
+    return candidates
+
+def matchesAll(schema, fields, conditions):
+    """True if the record fields satisfy every (field_name, bounds) condition."""
+    for field_name, (low, high, includeLow, includeHigh) in conditions:
+        try:
+            value = encodeKey(schema.fieldType(field_name), fields[schema.fieldIndex(field_name)])
+        except ValueError:
+            return False
+        if not inBounds(value, low, high, includeLow, includeHigh):
+            return False
+    return True
 
-    text = ""
+def executePlan(schema, plan):
+    """Returns the records the plan selects joined with spaces, in primary key order."""
+    type_name = schema.name
+    low, high, includeLow, includeHigh = plan.bounds
+    decode = recordDecoder(schema)
 
-    for line in lines:
-        if line[0: len(type_name)] == type_name:
-            text = line
-            break
+    if plan.kind == "full scan":
+        records = scanRecords(schema, plan.field_name, low, high, includeLow, includeHigh)
+    elif plan.field_name == schema.primKeyName:
+        records = readRecords(schema, bTrees[type_name].scan(low, high, includeLow, includeHigh), decode=decode)
+    else:
+        # read the matches in address order, then return them in primary key order like the other plans
+        entries = sorted(scanSecondary(bTrees[(type_name, plan.field_name)], low, high, includeLow, includeHigh),
+                         key=lambda entry: entry[1])
+        records = sorted(readRecords(schema, entries, decode=decode),
+                         key=lambda fields: encodeKey(schema.primKeyType, fields[schema.primKeyOrder-1]))
+
+    if plan.residual:
+        records = (fields for fields in records if matchesAll(schema, fields, plan.residual))
+    return (schema.recordFormat.joinFields(fields) for fields in records)
+
+def filterRecord(type_name, conditions, outputFile):
+    """Writes the records that satisfy all conditions, e.g. ["hp>100", "id<50"], in primary key order."""
+    if type_name not in catalog:
+        return False
 
-    pkey_order = int(text.split(",")[2])
+    schema = catalog[type_name]
+    fields = parseConditions(schema, conditions)
 
-    b = text.split(",")[3+(pkey_order-1)*2].strip("][")
-    b2 = b.replace("'","") 
-    pkey_name = b2.replace(" ","")    
-    
+    if not fields:
+        return False
 
-    if ">" in condition:
-        a = condition.split(">")
-        no = -1
-        edge = ""
-        if a[0] == pkey_name:
-            no= 1
-            edge = a[1].strip()
-        elif a[1]  == pkey_name:
-            edge = a[0].strip()
-            no = 0
-        else: 
-            return False
-        result=""
-
-        for key in keys:
-
-            if str(key).isnumeric():
-                key = int(key)
-                edge = int(edge)
-            if no == 0 and key < edge:  # 5>id
-                result,success = searchRecord(type_name,str(key))
-                outputFile.write(result+"\n")
-                
-            if no ==1 and key > edge:   #id > 5
-                result,success = searchRecord(type_name,str(key))
-                outputFile.write(result+"\n")
-        
-    if "<" in condition:
-        #id<3
-        a = condition.split("<")
-        no = -1
-        edge = ""
-        if a[0] == pkey_name:
-            no= 1
-            edge = a[1].strip()
-        elif a[1] == pkey_name:
-            edge = a[0].strip()
-            no = 0
-        else: 
-            return False
-        result=""
-
-        for key in keys:
-
-            if str(key).isnumeric():
-                key = int(key)
-                edge = int(edge)
-            if no == 0 and key > edge:  # 5<id
-                result,success = searchRecord(type_name,str(key))
-                outputFile.write(result+"\n")
-                
-            if no ==1 and key < edge:   #id < 5
-                result,success = searchRecord(type_name,str(key))
-                outputFile.write(result+"\n")
-
-    if "=" in condition:
-        a = condition.split("=")
-       
-        edge = ""
-        if a[0] == pkey_name:
-            
-            edge = a[1].strip()
-        elif a[1]  == pkey_name:
-            edge = a[0].strip()
-        
-        else:
-            return False
-            
-        result=""
+    for record in executePlan(schema, planFilter(schema, fields)[0]):
+        outputFile.write(record+"\n")
 
-        for key in keys:
+    return True
 
-            if str(key).isnumeric():
-                key = int(key)
-                edge = int(edge)
-            if  key == edge:  # 5=id
-                result,success = searchRecord(type_name,str(key))
-                outputFile.write(result+"\n")
-                
-            
-        
-            
+def explainFilter(type_name, conditions, outputFile):
+    """Writes the plan filterRecord would use for the conditions and its estimates, then the
+    plans it was preferred to."""
+    if type_name not in catalog:
+        return False
+
+    schema = catalog[type_name]
+    fields = parseConditions(schema, conditions)
 
+    if not fields:
+        return False
 
+    candidates = planFilter(schema, fields)
+    plan = candidates[0]
+    outputFile.write("plan: " + plan.describe(type_name) + "\n")
+    if plan.residual:
+        outputFile.write("filter: " + " and ".join(describeBounds(field_name, bounds) for field_name, bounds in plan.residual) + "\n")
+    outputFile.write("estimate: {:.0f} rows, {:.0f} page reads\n".format(plan.rows, plan.pageReads))
+    for other in candidates[1:]:
+        outputFile.write("alternative: {}, {:.0f} page reads\n".format(other.describe(type_name), other.pageReads))
 
     return True
 
-def saveBTrees():
+def fieldDecoder(schema, fieldNos):
+    """Returns a decode function for readRecords and scanFields that reads only the fields
+    fieldNos of a record, into a list that is None for the other fields."""
+    decodeField = schema.recordFormat.decodeField
+    nofFields = schema.nofFields
+
+    def decode(data, offset):
+        fields = [None] * nofFields
+        for fieldNo in fieldNos:
+            fields[fieldNo] = decodeField(data, offset+1, fieldNo)
+        return fields
+
+    return decode
+
+def recordDecoder(schema):
+    """A decode function for readRecords that returns every field of the record, unlike
+    readRecords itself it keeps a null field as None."""
+    recordFormat = schema.recordFormat
+
+    def decode(data, offset):
+        record = recordFormat.view(data, offset+1)
+        fields = recordFormat.unpack(record)
+        record.release()
+        return fields
+
+    return decode
+
+def scanFields(schema, decode):
+    """Yields the address and decode(data, offset) of every used record of the data files,
+    read straight from their mappings like scanRecords."""
+    for fileName in schema.files:
+        bufferPool.writeBackFile(fileName)
+        dataFile = bufferPool.file(fileName)
+        data = dataFile.map
+        fileNo = schema.fileNo(fileName)
+        try:
+            for pageNo in range(len(data) // PAGESIZE):
+                for slot in range(schema.recordsInAPage):
+                    offset = pageNo*PAGESIZE + schema.recordOffset(slot)
+                    if data[offset] == ord("1"):
+                        yield packAddress(fileNo, pageNo, slot), decode(data, offset)
+        finally:
+            del data
+            dataFile.release()
+
+def aggregateTree(schema, function, conditions):
+    """count, min and max of the primary key answered from the B+ tree alone, for conditions
+    that are only on the primary key.
+    Returns:
+        str: the result, None if there is no record in the bounds
+    """
+    b_tree = bTrees[schema.name]
+    low, high, includeLow, includeHigh = conditions.get(schema.primKeyName, (None, None, True, True))
 
-    
-    type_names = getAllTypeNames()
-    i = 0
-    #print(type_names,"savebtreesdeki typenames")
-  
-    #print(len(bTrees))
-    #print(len(type_names))
-    for bTree_name in bTrees:
-        leaves = []
-        values = []
-        dic = {}
-        bTree = bTrees[bTree_name]
-        file = open("bTree"+type_names[i]+".txt", "w+")
+    if function == "count":
+        if not conditions and isinstance(b_tree, BPlusTree):
+            return str(b_tree.size)
+        return str(sum(1 for entry in b_tree.scan(low, high, includeLow, includeHigh)))
 
-        leftMost = bTree.leftmost_leaf()
+    if function == "min":
+        entry = next(b_tree.scan(low, high, includeLow, includeHigh), None)
+    else:
+        entry = b_tree.last(high, includeHigh)
+        if entry is not None and not inBounds(entry[0], low, None, includeLow, True):
+            entry = None
+    return None if entry is None else str(entry[0])
+
+def aggregateRecord(type_name, function, field_name, group_name, conditions, outputFile):
+    """Writes count, min, max, sum or avg of field_name over the records that satisfy the
+    conditions, one line per value of group_name if it is given. The records are read once
+    and only the fields the aggregate uses are decoded.
+    """
+    if type_name not in catalog:
+        return False
 
+    schema = catalog[type_name]
+    if function not in AGGREGATES or (field_name is None and function != "count"):
+        return False
+    for name in (field_name, group_name):
+        if name is not None and schema.fieldIndex(name) == -1:
+            return False
+    if function in ("sum", "avg") and schema.fieldType(field_name) != "int":
+        return False
 
-        while leftMost is not None:
-            leaves.extend(leftMost.keys)
-            values.extend(leftMost.values) 
-            leftMost =  leftMost.next      
+    fields = parseConditions(schema, conditions) if conditions else {}
+    if fields is None:
+        return False
+    if function == "count" and not isinstance(schema.recordFormat, BinaryRecordFormat):
+        # a text record has every field, so counting a field counts the records
+        field_name = None
+
+    if (function in ("count", "min", "max") and group_name is None and field_name in (None, schema.primKeyName)
+            and all(name == schema.primKeyName for name in fields)):
+        result = aggregateTree(schema, function, fields)
+        if result is not None:
+            outputFile.write(result+"\n")
+        return True
+
+    fieldNos = [schema.fieldIndex(name) for name in [field_name, group_name] + list(fields) if name is not None]
+    decode = fieldDecoder(schema, sorted(set(fieldNos)))
+    if not fields:
+        records = (record for address, record in scanFields(schema, decode))
+    else:
+        plan = planFilter(schema, fields)[0]
+        conditionList = list(fields.items())
+        if plan.kind == "full scan":
+            records = (record for address, record in scanFields(schema, decode))
+        elif plan.field_name == schema.primKeyName:
+            records = readRecords(schema, bTrees[type_name].scan(*plan.bounds), decode=decode)
+        else:
+            records = readRecords(schema, scanSecondary(bTrees[(type_name, plan.field_name)], *plan.bounds), decode=decode)
+        records = (record for record in records if matchesAll(schema, record, conditionList))
+
+    fieldNo = schema.fieldIndex(field_name) if field_name is not None else -1
+    fieldType = schema.fieldType(field_name) if field_name is not None else None
+    groupNo = schema.fieldIndex(group_name) if group_name is not None else -1
+
+    # group value -> [count, sum or extreme value, field of the extreme value]
+    groups = {}
+    for record in records:
+        if groupNo >= 0 and record[groupNo] is None:
+            # a null field belongs to no group
+            continue
+        group = groups.setdefault(record[groupNo] if groupNo >= 0 else None, [0, None, None])
+        if function == "count":
+            if fieldNo < 0 or record[fieldNo] is not None:
+                group[0] += 1
+            continue
+        try:
+            value = encodeKey(fieldType, record[fieldNo])
+        except ValueError:
+            continue
+        group[0] += 1
+        if function in ("sum", "avg"):
+            group[1] = value if group[1] is None else group[1] + value
+        elif group[1] is None or (value < group[1] if function == "min" else group[1] < value):
+            group[1] = value
+            group[2] = record[fieldNo]
+
+    if group_name is None and not groups:
+        groups[None] = [0, None, None]
+
+    def groupOrder(group):
+        try:
+            return 0, encodeKey(schema.fieldType(group_name), group)
+        except ValueError:
+            return 1, group
+
+    for group in sorted(groups, key=groupOrder) if group_name is not None else groups:
+        count, value, field = groups[group]
+        if function == "count":
+            result = str(count)
+        elif function == "sum":
+            result = str(value if value is not None else 0)
+        elif count == 0:
+            continue
+        elif function == "avg":
+            result = str(value / count)
+        else:
+            result = field
+        outputFile.write((group + " " if group_name is not None else "") + result + "\n")
 
-        for j in range(len(leaves)):
-            dic[leaves[j]] = values[j]
+    return True
 
-        file.write(str(json.dumps(dic)))
+def createIndex(type_name, field_name):
+    """Adds a secondary index on a field that is not the primary key and indexes the existing records."""
+    if type_name not in catalog:
+        return False
 
-        i = i + 1
+    schema = catalog[type_name]
+    if schema.fieldIndex(field_name) in (-1, schema.primKeyOrder-1) or field_name in schema.indexedFields():
+        return False
 
-        file.close()
+    bTrees[(type_name, field_name)] = buildSecondaryIndex(schema, field_name)
+    schema.setIndexedFields(schema.indexedFields() + [field_name])
+    catalog.save()
+    markModified(type_name)
 
+    return True
 
-def getAllTypeNames():
-    systemCat = open("systemCatalog.csv", "r+")
+def deleteIndex(type_name, field_name):
 
-    types = systemCat.readlines()
-    type_names = []
+    if type_name not in catalog or field_name not in catalog[type_name].indexedFields():
+        return False
 
-    for type in types:
-        type_names.append(type.split(',')[0])
+    schema = catalog[type_name]
+    bTrees.drop((type_name, field_name))
+    if os.path.exists(secondaryName(type_name, field_name)):
+        os.remove(secondaryName(type_name, field_name))
+    schema.setIndexedFields([field for field in schema.indexedFields() if field != field_name])
+    catalog.save()
 
-    return type_names
+    return True
 
-def createbTrees():
+def snapshotName(type_name):
+    return "bTree" + type_name + ".bin"
+
+def secondaryName(type_name, field_name):
+    return "bTree" + type_name + "." + field_name + ".bin"
+
+def indexFileName(type_name):
+    return "bTree" + type_name + ".idx"
+
+def newIndex(schema):
+    """An empty in-memory B+ tree, or the paged one for types created with index=paged."""
+    if schema.options.get("index") == "paged":
+        return PagedBPlusTree(indexFileName(schema.name), schema.name, schema.primKeyType)
+    return BPlusTree(schema.fanout(), "q" if schema.primKeyType == "int" else None, "Q")
+
+def newSecondaryIndex(schema):
+    """An empty secondary index. Its keys are (field value, record address) pairs, the address
+    keeps the keys unique when records share a value."""
+    return BPlusTree(schema.fanout(), None, "Q")
+
+def secondaryKey(schema, field_name, fields, address):
+    """The key of a record in the secondary index on field_name, None if the field value does
+    not fit the type of the field. Such records are left out of the index."""
+    try:
+        return encodeKey(schema.fieldType(field_name), fields[schema.fieldIndex(field_name)]), address
+    except ValueError:
+        return None
+
+def indexRecord(schema, fields, address):
+    """Adds a record to the secondary indexes of its type."""
+    for field_name in schema.indexedFields():
+        key = secondaryKey(schema, field_name, fields, address)
+        if key is not None:
+            bTrees[(schema.name, field_name)].insert(key, address)
+
+def unindexRecord(schema, fields, address):
+    """Removes a record from the secondary indexes of its type."""
+    for field_name in schema.indexedFields():
+        key = secondaryKey(schema, field_name, fields, address)
+        if key is not None:
+            bTrees[(schema.name, field_name)].delete(key)
+
+def buildSecondaryIndex(schema, field_name):
+    """Indexes field_name of every record of the type, reading the records in one pass."""
+    entries = list(bTrees[schema.name].scan())
+    items = []
+    for (key, address), fields in zip(entries, readRecords(schema, entries, decode=recordDecoder(schema))):
+        secondary = secondaryKey(schema, field_name, fields, address)
+        if secondary is not None:
+            items.append((secondary, address))
+    items.sort()
+
+    tree = newSecondaryIndex(schema)
+    tree.bulkLoad(items, BULK_FILL_FACTOR)
+    return tree
+
+def loadSecondaryIndex(schema, field_name):
+    if not os.path.exists(secondaryName(schema.name, field_name)):
+        return buildSecondaryIndex(schema, field_name)
+
+    items = [((key, address), address) for key, address in readSnapshot(secondaryName(schema.name, field_name))]
+    tree = newSecondaryIndex(schema)
+    tree.bulkLoad(items, BULK_FILL_FACTOR)
+    return tree
+
+def scanSecondary(tree, low=None, high=None, includeLow=True, includeHigh=True):
+    """BPlusTree.scan with bounds on the field value of (field value, address) keys."""
+    for key, address in tree.scan(None if low is None else (low,)):
+        if low is not None and not includeLow and key[0] == low:
+            continue
+        if high is not None and (high < key[0] or (key[0] == high and not includeHigh)):
+            return
+        yield key, address
 
-    type_names = getAllTypeNames()
+def packAddress(fileNo, pageNo, slot):
+    """A record address as one integer: the data file number, the page in the file and the slot."""
+    return fileNo << 32 | pageNo << 16 | slot
 
-    i = 0
+def unpackAddress(address):
+    """Returns:
+        (int,int,int): file number, page number and slot of a packed record address
+    """
+    return address >> 32, (address >> 16) & 0xFFFF, address & 0xFFFF
 
-    for type_name in type_names:
+def checkpoint():
+    """Saves the changed indexes and free-space maps and writes back every changed page, after
+    which the log holds nothing that is not in the files and is emptied."""
+    saveBTrees()
+    saveFreeSpaceMaps()
+    bufferPool.flush()
+    writeAheadLog.checkpoint()
+    modifiedTypes.clear()
+    compressColdSegments()
+
+def compressColdSegments():
+    """Compresses the data files of compress=<codec> types that were not written for
+    COLD_SEGMENT_AGE seconds, except the newest file of each type, which takes the inserts.
+    Only called on a checkpoint, when the pool holds no changed page of the files."""
+    for type_name in catalog.names():
+        schema = catalog[type_name]
+        codecName = schema.options.get("compress")
+        if codecName is None:
+            continue
+        for fileName in schema.files[:-1]:
+            dataFile = bufferPool.file(fileName)
+            if isinstance(dataFile, CompressedDataFile) and dataFile.plain is None:
+                continue
+            if time.time() - os.path.getmtime(fileName) < COLD_SEGMENT_AGE:
+                continue
+            image = compressedImage(dataFile, codecName)
+            bufferPool.dropFile(fileName)
+            writeFileAtomically(fileName, image)
 
-        file = open("bTree"+type_names[i]+".txt", "r+")
+def saveBTrees():
+    """Saves the loaded indexes. Types that were not used in this run are left as they are."""
+    for name, b_tree in bTrees.items():
+        saveBTree(name, b_tree)
+
+def saveBTree(name, b_tree):
+    """Writes a snapshot of the index if its type changed during this run. Paged indexes only
+    write back their changed pages."""
+    logBeforeWrite()
+    if isinstance(b_tree, PagedBPlusTree):
+        b_tree.flush()
+    elif type(name) is tuple:
+        type_name, field_name = name
+        if type_name in modifiedTypes or not os.path.exists(secondaryName(type_name, field_name)):
+            # the address in a secondary key is the value of its entry, only the field value is kept
+            writeSnapshot(secondaryName(type_name, field_name), catalog[type_name].fieldType(field_name) != "int",
+                          ((key[0], address) for key, address in b_tree.scan()))
+    elif name in modifiedTypes or not os.path.exists(snapshotName(name)):
+        writeSnapshot(snapshotName(name), catalog[name].primKeyType != "int", b_tree.scan())
+        if os.path.exists("bTree" + name + ".txt"):
+            os.remove("bTree" + name + ".txt")
+
+def writeSnapshot(fileName, isStr, items):
+    """Writes (key, address) pairs that are in key order.
+    Snapshot layout: a header (magic, version, 1 for str keys, number of keys), the keys in
+    order, then the packed address of each record as an 8 byte integer.
+    int keys are 8 byte integers, str keys are a table of lengths followed by the utf-8 bytes.
+    """
+    keys = []
+    addresses = array.array("Q")
 
-        bplustree = BPlusTree()
+    for key, address in items:
+        keys.append(key)
+        addresses.append(address)
 
-        text = file.read()
-        #print(text)
+    if isStr:
+        encoded = [key.encode() for key in keys]
+        keyArrays = [array.array("H", [len(key) for key in encoded])]
+    else:
+        keyArrays = [array.array("q", keys)]
+
+    if sys.byteorder == "big":
+        for arr in keyArrays + [addresses]:
+            arr.byteswap()
+
+    parts = [SNAPSHOT_HEADER.pack(SNAPSHOT_MAGIC, SNAPSHOT_VERSION, isStr, len(keys)), keyArrays[0].tobytes()]
+    if isStr:
+        parts.extend(encoded)
+    parts.append(addresses.tobytes())
+    # a checkpoint empties the log right after, so the snapshot has to be on disk by then
+    writeFileAtomically(fileName, b"".join(parts))
+
+def readSnapshot(fileName):
+    """Reads a snapshot written by writeSnapshot.
+    Returns:
+        list: (key, address) pairs in key order
+    """
+    f = open(fileName, "rb")
+    data = f.read()
+    f.close()
+
+    magic, version, isStr, count = SNAPSHOT_HEADER.unpack_from(data)
+    if magic != SNAPSHOT_MAGIC or version != SNAPSHOT_VERSION:
+        raise ValueError("unknown index snapshot format in " + fileName)
+    offset = SNAPSHOT_HEADER.size
+
+    if isStr:
+        lengths = array.array("H", data[offset:offset + 2*count])
+        if sys.byteorder == "big":
+            lengths.byteswap()
+        offset += 2*count
+        keys = []
+        for length in lengths:
+            keys.append(data[offset:offset+length].decode())
+            offset += length
+    else:
+        keys = array.array("q", data[offset:offset + 8*count])
+        if sys.byteorder == "big":
+            keys.byteswap()
+        keys = keys.tolist()
+        offset += 8*count
+
+    addresses = array.array("Q", data[offset:offset + 8*count])
+    if sys.byteorder == "big":
+        addresses.byteswap()
+
+    return list(zip(keys, addresses))
+
+def encodeKey(key_type, value):
+    """Converts a primary key to its declared type so that the index orders it natively.
+    Raises ValueError if the value does not fit the type, or is None (a null field)."""
+    if value is None:
+        raise ValueError("null fields have no key")
+    if key_type == "int":
+        value = int(value)
+        if not -2**63 <= value < 2**63:
+            raise ValueError("int keys are 64 bit")
+    return value
+
+def markModified(type_name):
+    """Records a change to a type, so that its indexes and free-space map are saved."""
+    modifiedTypes.add(type_name)
+    typeVersions[type_name] += 1
+
+def saveFreeSpaceMaps():
+
+    for type_name in freeSpaceMaps:
+        if type_name not in modifiedTypes and os.path.exists("freeSpace" + type_name + ".txt"):
+            continue
+        writeFileAtomically("freeSpace" + type_name + ".txt", freeSpaceMaps[type_name].dumps().encode())
+
+def loadFreeSpaceMap(schema):
+    """Loads the free-space map of a type. A type without one, e.g. from an older database,
+    gets it rebuilt from the record headers of its data files."""
+    type_name = schema.name
+    fsm = FreeSpaceMap(schema.lengthOfARecord, schema.pagesInAFile())
 
-        dic = json.loads(text)
+    if os.path.exists("freeSpace" + type_name + ".txt"):
+        file = open("freeSpace" + type_name + ".txt")
+        files = json.loads(file.read())["files"]
+        file.close()
+        for fileName in files:
+            fsm.addFile(fileName, files[fileName])
+    else:
+        for fileName in schema.files:
+            fsm.readFile(fileName)
+
+    return fsm
+
+def loadBTree(schema):
+    """Rebuilds the index of a type from its snapshot in one bottom-up pass. Indexes that
+    were saved as JSON by older versions are converted to a snapshot at the next save, and
+    a type without a saved index gets it rebuilt from its data files."""
+    type_name = schema.name
+    exists = os.path.exists(indexFileName(type_name))
+    bplustree = newIndex(schema)
+
+    if isinstance(bplustree, PagedBPlusTree):
+        if not exists:
+            bplustree.bulkLoad(scanIndexItems(schema), BULK_FILL_FACTOR)
+        # the index file is read page by page as searches reach it
+        return bplustree
+
+    if os.path.exists(snapshotName(type_name)):
+        items = readSnapshot(snapshotName(type_name))
+    elif os.path.exists("bTree"+type_name+".txt"):
+        file = open("bTree"+type_name+".txt", "r")
+        text = file.read()
+        file.close()
 
+        dic = json.loads(text) if text != "" else {}
+        items = []
         for key in dic:
-            bplustree.insert(key, dic[key])
+            fileName, byte = dic[key].split(",")
+            items.append((encodeKey(schema.primKeyType, key), schema.addressOfByte(schema.fileNo(fileName), int(byte))))
+        items.sort()
+        modifiedTypes.add(type_name)
+    else:
+        items = scanIndexItems(schema)
 
-        bTrees[type_name] = bplustree
+    bplustree.bulkLoad(items, BULK_FILL_FACTOR)
 
-        i = i + 1
+    return bplustree
 
 
+def scanIndexItems(schema):
+    """Returns the (primary key, address) pairs of the records in the data files, sorted by key."""
+    decode = fieldDecoder(schema, [schema.primKeyOrder-1])
+    items = []
+    for address, fields in scanFields(schema, decode):
+        try:
+            items.append((encodeKey(schema.primKeyType, fields[schema.primKeyOrder-1]), address))
+        except ValueError:
+            continue
+    items.sort()
+    return items
+
+def replayLog(fileName=WAL_FILE):
+    """Redoes the changes logged by a run that ended without a checkpoint. Every change is
+    written again into its record slot, in log order, so the last change to a slot wins
+    whatever part of the run reached the data files. The indexes and free-space maps of the
+    types in the log are then rebuilt from the data files. A line that is cut short ends the
+    log: its group was never synced.
+    Returns:
+        int: the number of changes replayed
+    """
+    if not os.path.exists(fileName):
+        return 0
+
+    entries = []
+    length = 0
+    file = open(fileName, "rb")
+    for line in file:
+        words = line.decode("utf-8", "replace").split()
+        if not line.endswith(b"\n") or len(words) < 3 or words[0] not in ("create", "update", "delete", "load", "drop"):
+            break
+        entries.append(words)
+        length += len(line)
+    file.close()
+    if length != os.path.getsize(fileName):
+        os.truncate(fileName, length)
+
+    changes = collections.OrderedDict()
+    for op, type_name, address, *fields in entries:
+        if op == "drop":
+            changes.pop(type_name, None)
+            if type_name not in catalog:
+                # the type left the catalog, remove the files its drop had not removed yet
+                for item in fields:
+                    if os.path.exists(item):
+                        os.remove(item)
+        else:
+            changes.setdefault(type_name, []).append((op, int(address), [decodeLogField(word) for word in fields]))
+
+    for type_name, typeChanges in changes.items():
+        if type_name not in catalog:
+            continue
+        schema = catalog[type_name]
+
+        for op, address, fields in typeChanges:
+            if op == "load":
+                continue
+            fileNo, pageNo, slot = unpackAddress(address)
+            dataFileName = schema.dataFile(fileNo)
+            if not os.path.exists(dataFileName):
+                formatDataFile(dataFileName, schema.lengthOfARecord, schema.pagesInAFile())
+            if dataFileName not in schema.files:
+                schema.files.append(dataFileName)
+                catalog.save()
+
+            page = bufferPool.pin(dataFileName, pageNo)
+            start = schema.recordOffset(slot)
+            if op == "create":
+                page[start] = ord("1")
+                schema.recordFormat.pack_into(page, start+1, fields)
+            elif op == "update":
+                schema.recordFormat.pack_into(page, start+1, fields)
+            else:
+                page[start] = ord("0")
+            full = all(page[schema.recordOffset(i)] == ord("1") for i in range(schema.recordsInAPage))
+            page[0] = ord("1") if full else ord("0")
+            bufferPool.unpin(dataFileName, pageNo, True)
+
+        secondaries = [secondaryName(type_name, field_name) for field_name in schema.indexedFields()]
+        bTrees.drop(type_name)
+        freeSpaceMaps.pop(type_name, None)
+        for item in [snapshotName(type_name), indexFileName(type_name), "bTree" + type_name + ".txt", "freeSpace" + type_name + ".txt"] + secondaries:
+            if os.path.exists(item):
+                os.remove(item)
+        markModified(type_name)
+        # the secondary indexes are rebuilt now, while the pages and the rebuilt primary index
+        # agree, and not later inside a delete or update that has already changed one of them
+        for field_name in schema.indexedFields():
+            bTrees[(type_name, field_name)]
+
+    return len(entries)
+
 
 if __name__ == '__main__':
     #demo()
 
-    createbTrees()
+    catalog = SystemCatalog("systemCatalog.csv")
+    bufferPool = BufferPool()
+    # indexes and free-space maps are loaded when a command first uses their type
+    bTrees = IndexCache()
+    freeSpaceMaps = FreeSpaceMaps()
+    resultCache = ResultCache()
+
+    # a log left by a run that did not exit cleanly is replayed before any command
+    replayed = replayLog()
+    if replayed:
+        print("write-ahead log: replayed {} records".format(replayed))
+    writeAheadLog = WriteAheadLog()
 
     #print(len(bTrees))
 
@@ -1071,14 +3586,42 @@ if __name__ == '__main__':
             for i in range(nof_fields*2):
                 fieldsAndTypes[i] = words[5+i]
 
-            success = createType(type_name, nof_fields, prim_key_order, fieldsAndTypes)
+            # optional per-type settings, e.g. fanout=128
+            options = {}
+            for word in words[5+nof_fields*2:]:
+                if "=" in word:
+                    options[word.split("=")[0].lower()] = word.split("=")[1]
 
+            success = createType(type_name, nof_fields, prim_key_order, fieldsAndTypes, options)
+
+
+        if words[0].lower() == "create" and words[1].lower() == "index":
+            type_name = words[2]
+            field_name = words[3]
+
+            success = createIndex(type_name, field_name)
+
+        if words[0].lower() == "delete" and words[1].lower() == "index":
+            type_name = words[2]
+            field_name = words[3]
+
+            success = deleteIndex(type_name, field_name)
 
         if words[0].lower() == "delete" and words[1].lower() == "type":
             type_name = words[2]
 
             success = deleteType(type_name)
 
+        if words[0].lower() == "compact" and words[1].lower() == "type":
+            type_name = words[2]
+
+            success = compactType(type_name, outputFile)
+
+        if words[0].lower() == "list" and words[1].lower() == "segment":
+            type_name = words[2]
+
+            success = listSegments(type_name, outputFile)
+
         if words[0].lower() == "list" and words[1].lower() == "type":
 
             success = listType(outputFile)
@@ -1092,6 +3635,16 @@ if __name__ == '__main__':
 
             success = createRecord(type_name, fields)
 
+        if words[0].lower() == "load" and words[1].lower() == "record":
+            type_name = words[2]
+            csvFileName = words[3]
+            try:
+                fillFactor = float(words[4]) if len(words) > 4 else BULK_FILL_FACTOR
+            except ValueError:
+                fillFactor = None
+
+            success = loadRecords(type_name, csvFileName, fillFactor) if fillFactor is not None else False
+
         if words[0].lower() == "delete" and words[1].lower() == "record":
             type_name = words[2]
             prim_key = words[3]
@@ -1110,12 +3663,21 @@ if __name__ == '__main__':
 
         if words[0].lower() == "search" and words[1].lower() == "record":
             type_name = words[2]
-            prim_key = words[3]
-
-            result,success = searchRecord(type_name, prim_key)
-
-            if result is not None:
-                outputFile.write(result+"\n")
+            prim_keys = words[3:]
+
+            def search(output):
+                if len(prim_keys) == 1:
+                    result, found = searchRecord(type_name, prim_keys[0])
+                    results = [result]
+                else:
+                    # search record <type> <key1> <key2> ... reads the records in one sweep
+                    results, found = searchRecords(type_name, prim_keys)
+                for result in results:
+                    if result is not None:
+                        output.write(result+"\n")
+                return found
+
+            success = cachedQuery(type_name, words, search, outputFile)
 
             
 
@@ -1123,14 +3685,40 @@ if __name__ == '__main__':
         if words[0].lower() == "list" and words[1].lower() == "record":
             type_name = words[2]
 
-            success = listRecord(type_name, outputFile)
+            success = cachedQuery(type_name, words, lambda output: listRecord(type_name, output), outputFile)
 
         if words[0].lower() == "filter" and words[1].lower() == "record":
             type_name = words[2]
-            condition = words[3]
+            # several conditions are all applied, an "and" between them may be written out
+            conditions = [word for word in words[3:] if word.lower() != "and"]
 
-            success = filterRecord(type_name, condition, outputFile)
+            success = cachedQuery(type_name, words, lambda output: filterRecord(type_name, conditions, output),
+                                  outputFile)
 
+        if words[0].lower() in AGGREGATES and words[1].lower() == "record":
+            # count|min|max|sum|avg record <type> [field] [by <field>] [conditions]
+            type_name = words[2]
+            rest = [word for word in words[3:] if word.lower() != "and"]
+            field_name = None
+            group_name = None
+            if rest and rest[0].lower() != "by" and not any(operator in rest[0] for operator in "<>="):
+                field_name = rest.pop(0)
+            if len(rest) > 1 and rest[0].lower() == "by":
+                group_name = rest[1]
+                rest = rest[2:]
+
+            success = cachedQuery(type_name, words, lambda output: aggregateRecord(
+                type_name, words[0].lower(), field_name, group_name, rest, output), outputFile)
+
+        if words[0].lower() == "explain" and words[1].lower() == "filter" and words[2].lower() == "record":
+            type_name = words[3]
+            conditions = [word for word in words[4:] if word.lower() != "and"]
+
+            success = explainFilter(type_name, conditions, outputFile)
+
+
+        # changes stay pending at most about a window, also while read commands follow them
+        writeAheadLog.poll()
 
         if success:
             x = "success"
@@ -1153,7 +3741,13 @@ if __name__ == '__main__':
 
     #print(bTrees['Angel'].find("5").keys)
 
-    saveBTrees()
+    checkpoint()
+    bufferPool.close()
+    writeAheadLog.close()
+    print(bufferPool.stats())
+    print(bTrees.stats())
+    print(resultCache.stats())
+    print(writeAheadLog.stats())
     #print(checkFileEmpty("berf_1.txt"))
     outputFile.close()
     inputFile.close()